@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+########################################################################
+# merge rank files of run_ptest.py computed for different permutations
+# (e.g., shards run with different pstart, pnum) of the same edges
+#
+# python merge_ranks.py rank_file1 rank_file2 ... --pv (optional)
+#
+# e.g., to merge the ranks from 10,000 permutations computed in two shards
+#
+# >> python merge_ranks.py tr_human_net_me_rank_0_5000.txt tr_human_net_me_rank_5000_5000.txt --pv
+#
+# rank files are read from config.me_dir, and the merged ranks are stored as
+# $ptype_$efile(without extension)_me_rank_$pstart_$pnum.txt
+# with the smallest pstart and the total pnum of the shards
+# (the shards must cover contiguous ranges of permutations, e.g., 0-4999 and 5000-9999)
+# e.g., the above command generates "tr_human_net_me_rank_0_10000.txt"
+# (and "tr_human_net_me_pv_0_10000.txt", "tr_human_net_me_logp_0_10000.txt" with --pv)
+#
+# the number of permutations counted for each edge ("pnum" column of run_ptest.py)
+# is summed and used for the p-values and the name of the merged file
+# (so permutation files skipped by run_ptest.py are not counted)
+# for rank files without the column, the number of permutations of each file
+# is taken from its name; use -pn to give the total number of permutations otherwise
+# files are read in chunks, so the memory does not grow with the number of edges
+#
+########################################################################
+
+import os
+import argparse
+import logging
+import pandas
+
+from mut_ex import mut_ex
+import config
+
+# read arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("rank_files", help="rank file names", type=str, nargs='+')
+parser.add_argument("-pn", "--pnum", help="total number of permutations", type=int)
+parser.add_argument("-out", "--output_prefix", help="output filename prefix", type=str)
+parser.add_argument("--pv", help="compute pvalue?)", action='store_true')
+
+args = parser.parse_args()
+
+# INPUT FILES
+rank_files = [config.me_dir + f for f in args.rank_files]
+
+# number of permutations (from the "pnum" columns if any, see below)
+shards = [mut_ex.rank_file_pnum(f) for f in rank_files]
+counted = "pnum" in pandas.read_csv(rank_files[0], sep="\t", nrows=0).columns
+if args.pnum is not None:
+    pnum = args.pnum
+elif None in shards and not counted:
+    parser.error("cannot find the number of permutations from the file names (use -pn)")
+elif None not in shards:
+    pnum = sum([x[1] for x in shards])
+else:
+    pnum = None
+if None not in shards:
+    # shards must cover a contiguous range of permutations without overlaps
+    ranges = sorted(shards)
+    for (prev, cur) in zip(ranges[:-1], ranges[1:]):
+        if cur[0] != prev[0] + prev[1]:
+            parser.error("permutations %d-%d and %d-%d overlap or are not contiguous"
+                         % (prev[0], prev[0]+prev[1]-1, cur[0], cur[0]+cur[1]-1))
+parsed = [x[0] for x in shards if x is not None]
+pstart = min(parsed) if len(parsed) > 0 else 0
+logging.info("merging %d rank files.. " % len(rank_files))
+
+# OUTPUT FILES (named after the number of permutations once all files are read)
+if args.output_prefix is None:
+    efile_prefix = rank_files[0][:rank_files[0].rindex("me_rank_")]
+else:
+    efile_prefix = config.me_dir + args.output_prefix + "_"
+out_types = ["me_rank_"] + (["me_pv_", "me_logp_"] if args.pv else [])
+(rank_file, pvfile, logpfile) = [efile_prefix+x+"merged.tmp" for x in ["me_rank_", "me_pv_", "me_logp_"]]
+
+# merge chunk by chunk into temporary files
+# (replaced only after all files are read, so nothing is written if the files do not match)
+first = True
+total = 0
+for all_ranks in mut_ex.merge_rank_files(rank_files):
+    if counted:
+        # permutations actually counted (edges stopped early by -ad have fewer)
+        total = max(total, int(all_ranks["pnum"].max())) if len(all_ranks) > 0 else total
+    mode = 'w' if first else 'a'
+    all_ranks.to_csv(rank_file, sep="\t", index=False, mode=mode, header=first)
+    if args.pv:
+        # ptype and cancer types from the rank columns
+        ptype = "tr" if "norm_me_rank" in all_ranks.columns else "to"
+        cancers = [x[:-len("_me_rank")] for x in all_ranks.columns[4:] if x != "pnum"]
+        pvs = mut_ex.comp_pv(all_ranks, ptype, pnum, cancers)
+        pvs.to_csv(pvfile, sep="\t", index=False, mode=mode, header=first)
+        logps = mut_ex.comp_logp(pvs, ptype, cancers)
+        logps.to_csv(logpfile, sep="\t", index=False, mode=mode, header=first)
+    first = False
+if counted and (total > 0 or pnum is None):
+    pnum = total
+logging.info("%d permutations are merged" % pnum)
+for out_type in (out_types if not first else []):
+    os.replace(efile_prefix+out_type+"merged.tmp", efile_prefix+out_type+str(pstart)+"_"+str(pnum)+".txt")
@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 # module cover library
 
+import os
 import logging
 import time
+import multiprocessing
 import heapq as hq
+import numpy as np
 
+import utils.io as io
 import utils.misc as misc
+from utils.mut_matrix import MutMatrix
+from utils.score_graph import ScoreGraph
 
 def comp_cost(M, gene, Mavg, sum_dic, th, best_mod=-1):
 	"""
@@ -39,6 +45,28 @@ def comp_cost(M, gene, Mavg, sum_dic, th, best_mod=-1):
 	return min_cost, min_cost_m
 
 
+def comp_ben_cost(g, M, Mavg, sum_dic, best_heap, revised_dic, th):
+	"""
+	benefit/cost of adding g to its best module (or as a separate module)
+
+	:param g: gene to be considered
+	:param M: a list of currently selected modules
+	:param Mavg: Mavg[i] - the current avg cost of module i
+	:param sum_dic: sum_dic[z][i] - sum of cost from z to module i
+	:param best_heap: node -> IndexedHeap of (cost, module)
+	:param revised_dic: mutation dic with covered samples set to 0
+	:param th: module cost threshold
+	:return: (ben_cost, benefit, cost, module)
+	"""
+	if len(best_heap[g]) > 0:
+		bestg = best_heap[g][0][1]
+	else:
+		bestg = -1
+	(cost, m) = comp_cost(M, g, Mavg, sum_dic, th, bestg)
+	benefit = float(revised_dic[g].sum())
+	return benefit / float(cost), benefit, cost, m
+
+
 def update_modules(max_id, modules, max_g, Mavg, max_cost, th):
 	"""
 	Update modules by adding max_g
@@ -64,7 +92,7 @@ def update_modules(max_id, modules, max_g, Mavg, max_cost, th):
 	return (modules, mavg)
 
 
-def update_sum_dic(module_nodes, neighbors, sum_dic, max_module, score_dic, max_g):
+def update_sum_dic(module_nodes, neighbors, sum_dic, max_module, score_graph, max_g):
 	"""
 	update sum_dic
 	sum_dic[x][i]: sum of weights between x and a node in module_nodes
@@ -73,37 +101,119 @@ def update_sum_dic(module_nodes, neighbors, sum_dic, max_module, score_dic, max_
 	:param neighbors: all neighbors of module_nodes
 	:param sum_dic: old sum_dic
 	:param max_module: new module index
-	:param score_dic: edge score dic
+	:param score_graph: edge scores (ScoreGraph, symmetric)
 	:param max_g: selected gene
 	:return:
 
 	"""
+	# neighbors which already have an entry and new neighbors (i.e., the neighbors of max_g)
+	(old, new) = ([], [])
 	for neigh in neighbors:
-		# update sum_dic
-		# if the neighbor already has an entry
 		if neigh in sum_dic and max_module in sum_dic[neigh]:
-			score = misc.get_val(score_dic, neigh, max_g)
-			sum_dic[neigh][max_module] += score
-		# if the neighbor is new (i.e., the neighbor of max_g)
+			old.append(neigh)
 		else:
-			cost_list = []
-			for x in module_nodes:
-				score = misc.get_val(score_dic, neigh, x)
-				cost_list.append(score)
-			if neigh not in sum_dic:
-				sum_dic[neigh] = {}
-			sum_dic[neigh][max_module] = sum(cost_list)
+			new.append(neigh)
+	# add the score to max_g
+	for (neigh, score) in zip(old, score_graph.lookup(old, [max_g] * len(old))):
+		sum_dic[neigh][max_module] += score
+	# sum of the scores to the module nodes (visiting only the edges of the new neighbors)
+	sums = score_graph.row_sums(new, score_graph.member_mask(module_nodes))
+	for (neigh, score) in zip(new, sums):
+		if neigh not in sum_dic:
+			sum_dic[neigh] = {}
+		sum_dic[neigh][max_module] = float(score)
 	if max_g in sum_dic: # gene removed once selected
 		del sum_dic[max_g]
 
 
-def update_best_heap(best_heap, best_dic, neighbors, max_module, M,  sum_dic, Mavg, th):
+class IndexedHeap(object):
+	"""
+	binary min-heap of (key, item) with a position map item -> index in the heap,
+	so the key of an item is changed or the item is removed in O(log n)
+	heap[0] is the entry with the minimum key (ties broken by item, as heapq of tuples)
+	"""
+
+	def __init__(self, entries=()):
+		"""
+		:param entries: (key, item) with distinct items
+		"""
+		self.heap = list(entries)
+		hq.heapify(self.heap)
+		self.pos = dict([(item, i) for i, (_, item) in enumerate(self.heap)])
+
+	def __len__(self):
+		return len(self.heap)
+
+	def __getitem__(self, i):
+		return self.heap[i]
+
+	def __contains__(self, item):
+		return item in self.pos
+
+	def update(self, item, key):
+		""" set the key of item (inserted if not in the heap) """
+		if item not in self.pos:
+			self.heap.append((key, item))
+			self.pos[item] = len(self.heap) - 1
+			self._sift_up(len(self.heap) - 1)
+			return
+		i = self.pos[item]
+		old = self.heap[i]
+		self.heap[i] = (key, item)
+		if (key, item) < old:
+			self._sift_up(i)
+		else:
+			self._sift_down(i)
+
+	def remove(self, item):
+		""" remove item (if in the heap) """
+		if item not in self.pos:
+			return
+		i = self.pos.pop(item)
+		last = self.heap.pop()
+		if i == len(self.heap):
+			return
+		self.heap[i] = last
+		self.pos[last[1]] = i
+		if i > 0 and last < self.heap[(i - 1) // 2]:
+			self._sift_up(i)
+		else:
+			self._sift_down(i)
+
+	def _move(self, entry, i):
+		self.heap[i] = entry
+		self.pos[entry[1]] = i
+
+	def _sift_up(self, i):
+		entry = self.heap[i]
+		while i > 0:
+			parent = (i - 1) // 2
+			if not entry < self.heap[parent]:
+				break
+			self._move(self.heap[parent], i)
+			i = parent
+		self._move(entry, i)
+
+	def _sift_down(self, i):
+		entry = self.heap[i]
+		n = len(self.heap)
+		while 2 * i + 1 < n:
+			child = 2 * i + 1
+			if child + 1 < n and self.heap[child + 1] < self.heap[child]:
+				child += 1
+			if not self.heap[child] < entry:
+				break
+			self._move(self.heap[child], i)
+			i = child
+		self._move(entry, i)
+
+
+def update_best_heap(best_heap, neighbors, max_module, M,  sum_dic, Mavg, th):
 	"""
-	update best_dic and best_heap (using priority queue)
+	update best_heap (cost of adding each gene to each module, indexed by module)
 	with a module updated, best module for each gene is updated
 
-	:param best_heap: a heap representation of best_dic
-	:param best_dic: node -> module -> cost
+	:param best_heap: node -> IndexedHeap of (cost, module)
 	:param neighbors: all nodes to be updated
 	:param max_module: module to be updated
 	:param M: modules
@@ -115,18 +225,101 @@ def update_best_heap(best_heap, best_dic, neighbors, max_module, M,  sum_dic, Ma
 	for neigh in neighbors:
 		# the average score from neigh to module should be > th
 		if sum_dic[neigh][max_module] < th * len(M[max_module]):
-			if max_module in best_dic[neigh]:
-				del best_dic[neigh][max_module]
-				best_heap[neigh] = [(best_dic[neigh][x], x) for x in best_dic[neigh]]
-				hq.heapify(best_heap[neigh])
+			best_heap[neigh].remove(max_module)
 			continue
 		new = (Mavg[max_module] - 2 * sum_dic[neigh][max_module]) / len(M[max_module]) + th
-		best_dic[neigh][max_module] = new
-		if len(best_heap[neigh]) > 0 and best_heap[neigh][0][1] == max_module:
-			hq.heapreplace(best_heap[neigh], (new, max_module))
+		best_heap[neigh].update(max_module, new)
+
+
+def selected_genes(mod_dic):
+	"""
+	genes selected in order and their module ids
+
+	:param mod_dic: gene -> (itr, module_id, ...) (see io.read_module_file)
+	:return: list of (gene, module id) in the order of itr
+	"""
+	return [(g, mod_dic[g][1]) for g in sorted(mod_dic, key=lambda g: mod_dic[g][0])]
+
+
+def init_modules(init, score_graph, th):
+	"""
+	modules and Mavg after adding genes in order (as update_modules in greedy_module_cover)
+
+	:param init: list of (gene, module id) in the order selected
+	:param score_graph: edge scores (ScoreGraph, symmetric)
+	:param th: module cost threshold
+	:return: (M, Mavg, costs) costs: cost of each gene when added
+	"""
+	M, Mavg, costs = [], {}, []
+	for (g, m) in init:
+		if m > len(M):
+			raise ValueError("module %d of %s is not created yet" % (m, g))
+		if m < len(M):
+			module = M[m]
+			avg_corr = float(score_graph.lookup([g] * len(module), module).sum()) / len(module)
+			cost = 1 + (Mavg[m] / len(module) - 2 * avg_corr + th)  # as comp_cost
 		else:
-			best_heap[neigh] = [(best_dic[neigh][x], x) for x in best_dic[neigh]]
-			hq.heapify(best_heap[neigh])
+			cost = 1
+		(M, Mavg[m]) = update_modules(m, M, g, Mavg, cost, th)
+		costs.append(cost)
+	return M, Mavg, costs
+
+
+def init_sum_dic(M, GNet, selected, score_graph):
+	"""
+	sum_dic of modules M (as updated by update_sum_dic for each gene added)
+	sum_dic[x][i]: sum of weights between x and a node in module i
+	for each gene x adjacent to module i and not selected
+
+	:param M: modules
+	:param GNet: interaction network
+	:param selected: selected genes
+	:param score_graph: edge scores (ScoreGraph, symmetric)
+	:return: sum_dic
+	"""
+	sum_dic = {}
+	for i in range(len(M)):
+		neighbors = list(misc.neighbors(GNet, M[i]).difference(selected))
+		sums = score_graph.row_sums(neighbors, score_graph.member_mask(M[i]))
+		for (neigh, score) in zip(neighbors, sums):
+			if neigh not in sum_dic:
+				sum_dic[neigh] = {}
+			sum_dic[neigh][i] = float(score)
+	return sum_dic
+
+
+def init_best_heap(best_heap, M, sum_dic, Mavg, th):
+	"""
+	best_heap of all (gene, module) pairs in sum_dic (see update_best_heap)
+
+	:param best_heap: node -> IndexedHeap of (cost, module)
+	:param M: modules
+	:param sum_dic: dict g -> module -> sum of edge scores between g amd module
+	:param Mavg: dict average score within module
+	:param th: edge score threshold
+	"""
+	for neigh in sum_dic:
+		entries = []
+		for i in sum_dic[neigh]:
+			# the average score from neigh to module should be > th
+			if sum_dic[neigh][i] >= th * len(M[i]):
+				entries.append(((Mavg[i] - 2 * sum_dic[neigh][i]) / len(M[i]) + th, i))
+		best_heap[neigh] = IndexedHeap(entries)
+
+
+def module_frontiers(sum_dic, nmodules):
+	"""
+	genes adjacent to each module and not selected (the genes with an entry in sum_dic)
+
+	:param sum_dic: sum_dic[z][i] - sum of edge scores from z to module i
+	:param nmodules: number of modules
+	:return: list of sets of genes
+	"""
+	frontiers = [set([]) for i in range(nmodules)]
+	for neigh in sum_dic:
+		for i in sum_dic[neigh]:
+			frontiers[i].add(neigh)
+	return frontiers
 
 
 def update_cover_info(selected_g, revised_mut_dic, sample_cover_list, uncovered_samples):
@@ -158,19 +351,195 @@ def update_cover_info(selected_g, revised_mut_dic, sample_cover_list, uncovered_
 	return new_covered
 
 
+class CoverTracker(object):
+	"""
+	coverage information of module cover (see update_cover_info)
+	with a sample -> genes inverted index of the alteration matrix,
+	so covering a sample only touches the genes altered in it
+
+	rows: gene -> revised weights (covered samples set to 0), float32 rows of one matrix
+	benefits: sum of the revised weights of each gene (decremented in place, float64)
+	sample_cover_count: number of times TO BE COVERED for each sample
+	uncovered: set of samples not completely covered yet
+	"""
+
+	def __init__(self, mut_dic, k):
+		"""
+		:param mut_dic: dict[g] = list of weights (w[g][i] > 0 iff g covering sample i)
+		:param k: number of times a sample is covered (> 0)
+		"""
+		self.genes = list(mut_dic)
+		self.gene_idx = dict([(g, i) for i, g in enumerate(self.genes)])
+		self.weights = np.array([mut_dic[g] for g in self.genes], dtype=np.float32).reshape(len(self.genes), -1)
+		self.rows = dict([(g, self.weights[i]) for i, g in enumerate(self.genes)])
+		self.benefits = self.weights.sum(axis=1, dtype=np.float64)
+		nsamples = self.weights.shape[1]
+		# inverted index: genes altered in sample i are sample_genes[sample_ptr[i]:sample_ptr[i+1]]
+		(sample_idxs, self.sample_genes) = np.nonzero(self.weights.T)
+		self.sample_ptr = np.concatenate([[0], np.cumsum(np.bincount(sample_idxs, minlength=nsamples))])
+		# same type as the counts decremented by float32 weights
+		self.sample_cover_count = [np.float32(k)] * nsamples
+		self.uncovered = set(range(nsamples))
+
+	def benefit(self, gene):
+		""" current benefit of gene (float64 sum of the revised weights) """
+		return self.benefits[self.gene_idx[gene]]
+
+	def cover(self, selected_g):
+		"""
+		update coverage information with a selected gene (see update_cover_info)
+
+		:param selected_g: selected gene
+		:return: new_covered: set of newly covered sample indices
+		"""
+		row = self.rows.pop(selected_g)  # a gene cannot be selected multiple times
+		# covered samples are 0 in every row, so only uncovered samples of selected_g are decreased
+		touched = np.flatnonzero(row)
+		for i in touched:
+			self.sample_cover_count[i] -= row[i]
+		new_covered = set([int(i) for i in touched if self.sample_cover_count[i] <= 0])
+		self.uncovered.difference_update(new_covered)
+
+		# set the newly covered samples to 0 only for the genes altered in them
+		if len(new_covered) > 0:
+			covered = np.array(sorted(new_covered))
+			counts = self.sample_ptr[covered+1] - self.sample_ptr[covered]
+			cols = np.repeat(covered, counts)
+			gene_rows = np.concatenate([self.sample_genes[self.sample_ptr[c]:self.sample_ptr[c+1]] for c in covered])
+			np.subtract.at(self.benefits, gene_rows, self.weights[gene_rows, cols])
+			self.weights[gene_rows, cols] = 0
+		return new_covered
+
+	def cover_all(self, genes):
+		"""
+		update coverage information with genes selected in order at once
+		(same as calling cover for each gene)
+
+		:param genes: selected genes in order
+		:return: (benefits, counts)
+			benefits: benefit (sum of the revised weights) of each gene when selected
+			counts: number of times TO BE COVERED of each sample after each gene (genes x samples)
+		"""
+		ids = np.array([self.gene_idx[g] for g in genes], dtype=np.int64)
+		steps = np.arange(len(ids))
+		# counts decremented by all genes in order (acc[t]: after t genes)
+		acc = np.vstack([np.array(self.sample_cover_count, dtype=np.float32)[None], self.weights[ids]])
+		np.subtract.accumulate(acc, axis=0, out=acc)
+		# a sample is not decremented anymore once covered
+		crossed = acc[1:] <= 0
+		first = np.where(crossed.any(axis=0), crossed.argmax(axis=0), len(ids))
+		counts = np.take_along_axis(acc, np.minimum(steps[:, None], first[None]) + 1, axis=0)
+		benefits = np.where(steps[:, None] <= first[None], self.weights[ids], 0).sum(axis=1)
+
+		for g in genes:
+			self.rows.pop(g)  # a gene cannot be selected multiple times
+		self.sample_cover_count[:] = list(acc[np.minimum(first, len(ids)-1) + 1, np.arange(acc.shape[1])])
+		covered = np.flatnonzero(first < len(ids))
+		self.uncovered.difference_update(covered.tolist())
+		self.weights[:, covered] = 0
+		self.benefits = self.weights.sum(axis=1, dtype=np.float64)
+		return benefits, counts
+
+	def restore(self, selected, sample_cover_count, uncovered):
+		"""
+		restore coverage information after selecting genes (see save_checkpoint)
+
+		:param selected: selected genes
+		:param sample_cover_count: number of times TO BE COVERED for each sample
+		:param uncovered: samples not completely covered yet
+		"""
+		for g in selected:
+			self.rows.pop(g)
+		self.sample_cover_count[:] = list(np.asarray(sample_cover_count, dtype=np.float32))
+		covered = self.uncovered.difference(uncovered)
+		self.uncovered.intersection_update(uncovered)
+		self.weights[:, sorted(covered)] = 0
+		self.benefits = self.weights.sum(axis=1, dtype=np.float64)
+
+
+def save_checkpoint(filename, k, th, order, M, selected, Mavg, total_cost, sum_dic, tracker, itr_rows):
+	"""
+	write the state of greedy_module_cover in npz format
+	(best_heap, module frontiers and candidate heap are derived from it when loaded)
+	the file is replaced only after it is completely written
+
+	:param filename: checkpoint file
+	:param k: number of times a sample is covered
+	:param th: module cost threshold
+	:param order: gene -> order of nodes (tie-break)
+	:param M: modules
+	:param selected: selected genes in order
+	:param Mavg: Mavg[i] - the avg cost of module i
+	:param total_cost: total module cost
+	:param sum_dic: sum_dic[z][i] - sum of edge scores from z to module i
+	:param tracker: CoverTracker
+	:param itr_rows: lines written in the output file
+	"""
+	module_id = dict([(g, i) for i in range(len(M)) for g in M[i]])
+	sum_entries = [(x, i, sum_dic[x][i]) for x in sum_dic for i in sum_dic[x]]
+	(sum_genes, sum_modules, sum_scores) = zip(*sum_entries) if len(sum_entries) > 0 else ((), (), ())
+	temp_file = filename + ".tmp"
+	with open(temp_file, "wb") as f:
+		np.savez(f, k=k, th=th, nodes=np.array(sorted(order, key=order.get), dtype=str),
+					selected=np.array(selected, dtype=str),
+					module_ids=np.array([module_id[g] for g in selected], dtype=np.int64),
+					Mavg=np.array([Mavg[i] for i in range(len(M))], dtype=np.float64), total_cost=total_cost,
+					sum_genes=np.array(sum_genes, dtype=str), sum_modules=np.array(sum_modules, dtype=np.int64),
+					sum_scores=np.array(sum_scores, dtype=np.float64),
+					sample_cover_count=np.array(tracker.sample_cover_count, dtype=np.float32),
+					uncovered=np.array(sorted(tracker.uncovered), dtype=np.int64),
+					itr_rows=np.array(itr_rows, dtype=str))
+	os.replace(temp_file, filename)
+
+
+def load_checkpoint(filename, k, th):
+	"""
+	read the state of greedy_module_cover written by save_checkpoint
+
+	:param filename: checkpoint file
+	:param k: number of times a sample is covered (should be the same as in the checkpoint)
+	:param th: module cost threshold (should be the same as in the checkpoint)
+	:return: dict with order, M, selected, Mavg, total_cost, sum_dic,
+			sample_cover_count, uncovered, itr_rows
+	"""
+	data = np.load(filename)
+	if int(data["k"]) != k or float(data["th"]) != th:
+		raise ValueError("%s is a checkpoint of k=%d, th=%s" % (filename, int(data["k"]), str(float(data["th"]))))
+	selected = [str(g) for g in data["selected"]]
+	M = []
+	for (g, m) in zip(selected, data["module_ids"]):
+		if m == len(M):
+			M.append([])
+		M[m].append(g)
+	sum_dic = {}
+	for (x, i, score) in zip(data["sum_genes"], data["sum_modules"], data["sum_scores"]):
+		sum_dic.setdefault(str(x), {})[int(i)] = float(score)
+	return dict(order=dict([(str(g), i) for i, g in enumerate(data["nodes"])]), M=M, selected=selected,
+				Mavg=dict(enumerate([float(x) for x in data["Mavg"]])), total_cost=float(data["total_cost"]),
+				sum_dic=sum_dic, sample_cover_count=data["sample_cover_count"],
+				uncovered=set([int(i) for i in data["uncovered"]]), itr_rows=[str(r) for r in data["itr_rows"]])
+
+
 # main functions
-def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=False, l=0):
+def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=False, l=0, init=None,
+						checkpoint=None, cp=None, resume=False):
 	"""
 	Find a module cover
 	module weight = alpha + # nodes - sum of average weight for all nodes
 	:param mut_dic: dict[g] = list of weights (w[g][i] > 0 iff g covering sample i)
+			or MutMatrix (edge weights are used if kept, otherwise 1 for each covered sample)
 	:param GNet: interaction network
 	:param k: number of times a sample is covered
-	:param score_dic: edge score dic score_dic[x][y]
+	:param score_dic: edge scores (ScoreGraph, symmetric) or edge score dic score_dic[x][y]
 	:param th: module cost threshold
 	Optional
 	:param output: file to write the results
 	:param stop: boolean : stop module cover if the best module is singleton covering only one sample
+	:param init: list of (gene, module id) selected in order to start from
+			(e.g., selected_genes of io.read_module_file of a previous itr file, with the same or a smaller k)
+	:param checkpoint: checkpoint file (see save_checkpoint)
+	:param cp: write the checkpoint every cp iterations
+	:param resume: start from the checkpoint if it exists (init is ignored then)
 	Outdated
 	:param: l: number of outliers
 	:return:
@@ -179,14 +548,19 @@ def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=Fal
 	"""
 
 	# initializing...
+	if isinstance(mut_dic, MutMatrix):
+		mut_dic = mut_dic.weight_dic()  # gene -> row of the weight array (no copy)
+	if isinstance(score_dic, ScoreGraph):
+		score_graph = score_dic
+	else:
+		score_graph = ScoreGraph.from_dic(score_dic, symmetric=True)  # same scores as misc.get_val
 	# samples and genes
-	nsamples = len(mut_dic.values()[0])
+	nsamples = len(next(iter(mut_dic.values())))
 	nodes = set(mut_dic).intersection(GNet)
-	uncovered = set(range(nsamples))  # uncovered samples
-	sample_cover_count = [k for x in uncovered]  # number of times covered for each sample
-
-	revised_dic = dict([(g, list(mut_dic[g])) for g in mut_dic])  # deep copy of mut_dic
-	# when partial cover is given..
+	order = dict([(g, i) for i, g in enumerate(nodes)])
+	# revised weights (copy of mut_dic), number of times to be covered and uncovered samples
+	tracker = CoverTracker(mut_dic, k)
+	(revised_dic, sample_cover_count, uncovered) = (tracker.rows, tracker.sample_cover_count, tracker.uncovered)
 
 	# selected modules, selected genes, total module cost
 	M, selected, total_cost = [], [], 0
@@ -197,13 +571,57 @@ def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=Fal
 	Mavg, sum_dic = {}, {}
 
 	# For running time optimization
-	# best_dic: dictionary for the sum cost for (node, module) pair
-	# best_heap: a heap representation of best_dic
+	# best_heap: the cost for each (node, module) pair in a heap indexed by module
 	# makes it easier to find the best module and update the cost
-	best_dic, best_heap = {}, {}
+	best_heap = {}
 	for g in GNet:
-		best_dic[g] = {}
-		best_heap[g] = []
+		best_heap[g] = IndexedHeap()
+
+	# when partial cover is given..
+	# modules, coverage, sum_dic and best_heap are constructed at once for the given genes
+	itr_rows = []
+	if resume and checkpoint is not None and os.path.isfile(checkpoint):
+		state = load_checkpoint(checkpoint, k, th)
+		if set(state["order"]) != nodes:
+			raise ValueError("%s has different genes" % checkpoint)
+		(order, M, selected, Mavg) = (state["order"], state["M"], state["selected"], state["Mavg"])
+		(total_cost, sum_dic, itr_rows) = (state["total_cost"], state["sum_dic"], state["itr_rows"])
+		nodes.difference_update(selected)
+		tracker.restore(selected, state["sample_cover_count"], state["uncovered"])
+		init_best_heap(best_heap, M, sum_dic, Mavg, th)
+		logging.info("resume from %s (%d selected genes)" % (checkpoint, len(selected)))
+	elif init is not None and len(init) > 0:
+		selected = [g for (g, _) in init]
+		if len(set(selected)) < len(selected) or not nodes.issuperset(selected):
+			raise ValueError("initial genes should be distinct genes in both mut_dic and GNet")
+		(M, Mavg, costs) = init_modules(init, score_graph, th)
+		total_cost = sum(costs)
+		nodes.difference_update(selected)
+		(benefits, counts) = tracker.cover_all(selected)
+		sum_dic = init_sum_dic(M, GNet, selected, score_graph)
+		init_best_heap(best_heap, M, sum_dic, Mavg, th)
+		for t in range(len(init)):
+			itr_rows.append("%d\t%d\t%s\t%d\t%d\t%d\t%d\t%f\n" % (t+1, init[t][1], init[t][0],
+							k-counts[t].max(), k-counts[t].min(), k-counts[t].sum(dtype=np.float64)/nsamples,
+							benefits[t], costs[t]))
+		logging.info("start from %d selected genes in %d modules" % (len(selected), len(M)))
+
+	# frontiers[i]: genes adjacent to module i and not selected (updated with the selected gene)
+	frontiers = module_frontiers(sum_dic, len(M))
+	is_selected = set(selected)
+
+	# lazy greedy: candidate genes in a heap ordered by benefit/cost and then
+	# by the original benefit and the order of nodes (the tie-breaks of scanning nodes)
+	# benefits only decrease as samples are covered, so a key is an upper bound of the current
+	# benefit/cost until the cost changes (then the gene is pushed again with a new version)
+	# cand_heap: (-ben_cost, -original benefit, order, version, gene)
+	orig_benefit = dict([(g, np.sum(mut_dic[g])) for g in nodes])
+	version = dict([(g, 0) for g in nodes])
+	cand_heap = []
+	for g in nodes:
+		(ben_cost, _, _, _) = comp_ben_cost(g, M, Mavg, sum_dic, best_heap, revised_dic, th)
+		cand_heap.append((-ben_cost, -orig_benefit[g], order[g], 0, g))
+	hq.heapify(cand_heap)
 
 	# for debugging
 	prevtime = time.mktime(time.localtime())
@@ -212,6 +630,7 @@ def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=Fal
 	if output is not None:
 		f = open(output, 'w')
 		f.write("itr\tmodule_id\tselected_gene\tmost_covered\tleast_covers\tavg_covered\tbenefit\tcost\n")
+		f.writelines(itr_rows)
 
 	itr = len(selected)
 	max_g = None
@@ -224,23 +643,23 @@ def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=Fal
 		prevtime = curtime
 
 		# find the best node to add
+		# (the best benefit/cost; ties broken by the original benefit and then the order of nodes)
 		max_ben_cost = 0
-		for g in nodes:
-			# when best module for g is known
-			if len(best_heap[g]) > 0:
-				bestg = best_heap[g][0][1]
-			else:
-				bestg = -1
-			(cost, m) = comp_cost(M, g, Mavg, sum_dic, th, bestg)
-			new_module = m
-			benefit = sum(revised_dic[g])
-			ben_cost = benefit / float(cost)
-			if ben_cost < max_ben_cost:
+		while len(cand_heap) > 0:
+			(_, _, _, ver, g) = hq.heappop(cand_heap)
+			if version.get(g) != ver:
+				continue  # selected or pushed again with a new cost
+			# re-evaluate the top
+			(ben_cost, benefit, cost, new_module) = comp_ben_cost(g, M, Mavg, sum_dic, best_heap, revised_dic, th)
+			key = (-ben_cost, -orig_benefit[g], order[g], ver, g)
+			while len(cand_heap) > 0 and version.get(cand_heap[0][4]) != cand_heap[0][3]:
+				hq.heappop(cand_heap)
+			if len(cand_heap) > 0 and cand_heap[0] < key:
+				hq.heappush(cand_heap, key)  # not the best anymore
 				continue
-			if ben_cost > max_ben_cost or (max_g is not None and sum(mut_dic[g]) > sum(mut_dic[max_g])):
-				# if the gene is better than the current i
-				# or ties with the best and its original benefit is better
+			if ben_cost > 0:
 				(max_g, max_ben_cost, max_ben, max_cost, max_module) = (g, ben_cost, benefit, cost, new_module)
+			break
 
 		# STOP condition
 		# bug fixed for the last node being added with benefit = 0
@@ -252,23 +671,45 @@ def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=Fal
 		(M, Mavg[max_module]) = update_modules(max_module, M, max_g, Mavg, max_cost, th)
 		selected.append(max_g)  # max_g is selected
 		nodes.remove(max_g)  # max_g is removed from available genes
-		new_covered = update_cover_info(max_g, revised_dic, sample_cover_count, uncovered)  # revised_dic, cover_count
-		uncovered = uncovered.difference(new_covered)  # remove covered samples
+		del version[max_g]
+		tracker.cover(max_g)  # revised_dic, cover_count, uncovered samples
 		total_cost += max_cost  # total cost
 
-		# update sum_dic, best_dic, best_heap
+		# update module frontiers (only from the adjacency of max_g), sum_dic, best_heap
+		is_selected.add(max_g)
+		for i in sum_dic.get(max_g, {}):
+			frontiers[i].discard(max_g)
+		if max_module == len(frontiers):
+			frontiers.append(set([]))
+		frontiers[max_module].update([x for x in GNet.neighbors(max_g) if x not in is_selected])
 		module_nodes = M[max_module]
-		neighbors = misc.neighbors(GNet, module_nodes).difference(selected)
-		update_sum_dic(module_nodes, neighbors, sum_dic, max_module, score_dic, max_g)
-		update_best_heap(best_heap, best_dic, neighbors, max_module, M, sum_dic, Mavg, th)
+		neighbors = frontiers[max_module]
+		update_sum_dic(module_nodes, neighbors, sum_dic, max_module, score_graph, max_g)
+		update_best_heap(best_heap, neighbors, max_module, M, sum_dic, Mavg, th)
+		# the cost of the neighbors changed; the current benefit is an upper bound
+		# (with a margin for the rounding of the float32 row sums used as the benefit)
+		for g in neighbors:
+			if g in version:
+				version[g] += 1
+				bestg = best_heap[g][0][1] if len(best_heap[g]) > 0 else -1
+				(cost, _) = comp_cost(M, g, Mavg, sum_dic, th, bestg)
+				bound = tracker.benefit(g) * (1 + 1e-5)
+				hq.heappush(cand_heap, (-(bound / float(cost)), -orig_benefit[g], order[g], version[g], g))
 		# write progress
 		print_debug_message(itr, max_module, max_ben, max_cost, max_ben_cost, mut_dic[max_g], max_g)
 
 		# write in the output file
+		itr_rows.append("%d\t%d\t%s\t%d\t%d\t%d\t%d\t%f\n" % (itr, max_module, max_g,
+						k-max(sample_cover_count), k-min(sample_cover_count),
+						k-sum(sample_cover_count)/nsamples, max_ben, max_cost))
 		if output is not None:
-			f.write("%d\t%d\t%s\t%d\t%d\t%d\t%d\t%f\n" % (itr, max_module, max_g,
-					k-max(sample_cover_count), k-min(sample_cover_count),
-					k-sum(sample_cover_count)/nsamples, max_ben, max_cost))
+			f.write(itr_rows[-1])
+
+		if checkpoint is not None and cp is not None and itr % cp == 0:
+			logging.info("writing checkpoint (%d iterations)" % itr)
+			if output is not None:
+				f.flush()
+			save_checkpoint(checkpoint, k, th, order, M, selected, Mavg, total_cost, sum_dic, tracker, itr_rows)
 
 	if output is not None:
 		f.close()
@@ -276,13 +717,65 @@ def greedy_module_cover(mut_dic, GNet, k, score_dic, th=0, output=None, stop=Fal
 	return M, total_cost
 
 
+# inputs shared by the worker processes (see sweep_module_cover)
+_sweep_inputs = {}
+
+
+def _init_sweep_worker(mut_dic, GNet, score_graph, output_prefix, stop):
+	_sweep_inputs.update(mut_dic=mut_dic, GNet=GNet, score_graph=score_graph, output_prefix=output_prefix, stop=stop)
+
+
+def _sweep_task(setting):
+	""" run module cover for setting = (k, th) and write the itr and modules files
+	:return: (k, th, number of modules, number of genes, total cost, seconds taken)
+	"""
+	(k, th) = setting
+	t = _sweep_inputs
+	suffix = "_"+str(k)+"_"+str(th)+".txt"
+	starttime = time.time()
+	M, total_cost = greedy_module_cover(t["mut_dic"], t["GNet"], k, t["score_graph"], th,
+										t["output_prefix"]+"_itr"+suffix, t["stop"])
+	io.write_module_file(M, t["output_prefix"]+"_modules"+suffix)
+	return k, th, len(M), sum([len(m) for m in M]), total_cost, time.time() - starttime
+
+
+def sweep_module_cover(mut_dic, GNet, score_dic, settings, output_prefix, stop=False, workers=1):
+	""" run greedy_module_cover for each (k, th) in settings with a process pool
+	and write output_prefix+"_itr_k_th.txt" and output_prefix+"_modules_k_th.txt" for each
+	inputs are given to the workers once when the pool starts (inherited without copying
+	when processes are forked) and are not modified by greedy_module_cover
+
+	:param mut_dic: MutMatrix (weighted) or dict[g] = list of weights (see greedy_module_cover)
+	:param GNet: interaction network
+	:param score_dic: edge scores (ScoreGraph, symmetric) or edge score dic score_dic[x][y]
+	:param settings: list of (k, th)
+	:param output_prefix: output file prefix
+	:param stop: see greedy_module_cover
+	:param workers: number of worker processes
+	:return: list of (k, th, number of modules, number of genes, total cost, seconds taken)
+		in the order of settings
+	"""
+	if not isinstance(score_dic, ScoreGraph):
+		score_dic = ScoreGraph.from_dic(score_dic, symmetric=True)
+	inputs = (mut_dic, GNet, score_dic, output_prefix, stop)
+	if workers <= 1:
+		_init_sweep_worker(*inputs)
+		return [_sweep_task(setting) for setting in settings]
+	pool = multiprocessing.Pool(workers, _init_sweep_worker, inputs)
+	# one setting per task (running times differ a lot among settings)
+	summary = pool.map(_sweep_task, settings, chunksize=1)
+	pool.close()
+	pool.join()
+	return summary
+
+
 # print function
 def print_debug_message(itr, max_module, max_ben, max_cost, max_ben_cost, rel_g, max_g, interval=1):
 	if itr % interval == 0:
-		print str(itr) + ": " + max_g
+		print(str(itr) + ": " + max_g)
 		logging.debug("%d-th iteration----------------\n" % itr)
 		logging.debug("module id that the selected node will be added to :  %d\n" % max_module)
 		logging.debug("benefit is %d , cost is %d, max ben/cost is %d\n " % (max_ben, max_cost, max_ben_cost))
-		logging.debug("original benefit %d\n" % sum(rel_g))
+		logging.debug("original benefit %d\n" % np.sum(rel_g))
 		logging.debug("best node is %s\n" % max_g)
 
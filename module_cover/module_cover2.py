@@ -12,6 +12,7 @@ import os
 import numpy as np
 import networkx as nx
 import utils.misc as misc
+from utils.score_graph import ScoreGraph
 import time
 import heapq as hq
 
@@ -23,12 +24,16 @@ def update_w_dic(wdic, set_a, set_b, score_dics, coefs):
 	score = score_dic[x][y] (0 if there is no edge)
 
 	Parameters:
-		wdic: weight dic (gene->(gene->weight))
+		wdic: weight dic (gene->(gene->weight)) or WeightMatrix
 		set_a, set_b: compute weights between the two
-		score_dics:  list of interaction scores
+		score_dics:  list of interaction scores (dict score_dic[x][y] or ScoreGraph)
+			(not used for WeightMatrix, which is built from them)
 		g: file handler
 	Return wdic
 	"""
+	if isinstance(wdic, WeightMatrix):
+		wdic.visit(set_a, set_b)
+		return wdic
 	for x in set_a:
 		if x not in wdic:
 			wdic[x] = {}
@@ -36,7 +41,9 @@ def update_w_dic(wdic, set_a, set_b, score_dics, coefs):
 			if y not in wdic[x]:
 				scores = []
 				for sd in score_dics:
-					if x in sd and y in sd[x]:
+					if isinstance(sd, ScoreGraph):
+						score = sd.score(x, y)
+					elif x in sd and y in sd[x]:
 						score = sd[x][y]
 					else:
 						score = 0
@@ -59,10 +66,54 @@ def comp_mcost(aset, wdic, th):
 	if m == 1:
 		return 1
 	## total coherence
-	tcoh = sum([sum([wdic[g][h] for h in filter(lambda h: h != g, aset)]) for g in aset])
+	tcoh = comp_coherence(aset, wdic)
+
+	return mcost_from_coherence(m, tcoh, th)
+
+def comp_coherence(aset, wdic):
+	"""
+	total coherence of a module: sum_x sum_ (y not x) wdic[x][y]
+	"""
+	if isinstance(wdic, WeightMatrix):
+		return wdic.sum_weights(aset, aset)
+	return sum([sum([wdic[g][h] for h in filter(lambda h: h != g, aset)]) for g in aset])
 
+def comp_exact_mcost(aset, wdic, th):
+	"""
+	module cost with the weights summed pair by pair in the order of aset (comp_mcost on a weight dic)
+	costs from cached aggregates (see mcost_from_coherence) may differ from it in the last bits;
+	it decides between candidates with (almost) the same cost (see pop_best_entry)
+	"""
+	if not isinstance(wdic, WeightMatrix):
+		return comp_mcost(aset, wdic, th)
+	m = len(aset)
+	if m == 1:
+		return 1
+	return mcost_from_coherence(m, wdic.ordered_coherence(aset), th)
+
+def mcost_from_coherence(m, tcoh, th):
+	"""
+	module cost of a module with m genes and total coherence tcoh (see comp_mcost)
+	the total coherence of the union of disjoint modules m1, m2 is
+	tcoh(m1) + tcoh(m2) + 2 * comp_cross_weight(m1, m2), so merged modules
+	are evaluated from cached aggregates without visiting all pairs of genes
+	(the weights are summed in a different order, so costs are equal to comp_mcost
+	of the union only up to float rounding; merge_modules and overlap_modules choose
+	among (almost) tied candidates and print scores with comp_exact_mcost)
+	"""
+	if m == 1:
+		return 1
 	return (m * (1 + th) - tcoh / (m - 1))
 
+def comp_cross_weight(set_a, set_b, wdic, score_dics, coefs):
+	"""
+	sum of weights between two disjoint sets: sum_x sum_y wdic[x][y] (x in set_a, y in set_b)
+	"""
+	if isinstance(wdic, WeightMatrix):
+		return wdic.sum_weights(set_a, set_b)
+	wdic = update_w_dic(wdic, set_a, set_b, score_dics, coefs)
+	return sum([sum([wdic[x][y] for y in set_b]) for x in set_a])
+
 def comp_w(values, coefs, avg=0):
 	""" 
 	compute weight of an edge in module cover
@@ -76,6 +127,116 @@ def comp_w(values, coefs, avg=0):
 	"""
 	return sum([values[i] * coefs[i] for i in range(len(values))]) - avg
 
+def score_entries(score_dic):
+	""" (x, y, score) for all entries of score_dic (dict score_dic[x][y] or ScoreGraph)
+	"""
+	if isinstance(score_dic, ScoreGraph):
+		rows = np.repeat(np.arange(len(score_dic)), np.diff(score_dic.indptr))
+		return [(score_dic.genes[i], score_dic.genes[j], float(w))
+				for (i, j, w) in zip(rows, score_dic.indices, score_dic.weights)]
+	return [(x, y, score_dic[x][y]) for x in score_dic for y in score_dic[x]]
+
+class WeightMatrix(object):
+	"""
+	weights w(x, y) (see comp_w) of all pairs with a score in score_dics, computed once
+	and stored as a sparse matrix (ScoreGraph with integer gene ids), 0 for the other pairs
+	used instead of a weight dic (see update_w_dic) with the same weights:
+	scores are given for one orientation of a pair and w(x, y) = w(y, x) is fixed
+	to the weight of the orientation first visited (x in set_a of update_w_dic)
+	only the weights of the pairs with a score are kept (memory scales with the edges),
+	and pairs are visited through the rows of the matrix, not for all (x, y)
+	(sum_weights takes sums in the order of the rows, so they are equal
+	to the sums over a weight dic only up to float rounding; ordered_coherence sums in
+	the order of the genes as comp_coherence does, for the exact costs of comp_exact_mcost)
+	the weights are those of a weight dic built from the same scores only if the scores
+	are float64 (see io.read_score_graphs)
+
+	graph: ScoreGraph, entries (x, y) and (y, x) of each pair with a score (float64 weights)
+	fixed: x * n + y (x < y) -> weight fixed when the pair (x, y) is first visited
+	"""
+
+	def __init__(self, score_dics, coefs):
+		"""
+		:param score_dics: list of interaction scores (dict score_dic[x][y] or ScoreGraph)
+		:param coefs: coefficient of each score
+		"""
+		scores = {}  # (x, y) -> score in each score dic
+		for k in range(len(score_dics)):
+			for (x, y, score) in score_entries(score_dics[k]):
+				if (x, y) not in scores:
+					scores[(x, y)] = [0] * len(score_dics)
+				scores[(x, y)][k] = score
+		(xs, ys, weights) = ([], [], [])
+		for (x, y) in scores:
+			xs.append(x)
+			ys.append(y)
+			weights.append(comp_w(scores[(x, y)], coefs))
+			if (y, x) not in scores:  # the other orientation (without a score)
+				xs.append(y)
+				ys.append(x)
+				weights.append(comp_w([0] * len(score_dics), coefs))
+		self.graph = ScoreGraph.from_edges(xs, ys, weights, dtype=np.float64)
+		self.fixed = {}
+
+	def sum_weights(self, set_a, set_b):
+		"""
+		sum of w(x, y) over x in set_a, y in set_b (x != y)
+		the weights of the pairs not visited yet are fixed (as update_w_dic(set_a, set_b))
+		"""
+		n = len(self.graph)
+		mask = self.graph.member_mask(set_b)
+		total = 0
+		for x in set_a:
+			if x not in self.graph:
+				continue
+			i = self.graph.gene_idx[x]
+			(cols, weights) = self.graph.row(x)
+			selected = mask[cols]
+			for (j, w) in zip(cols[selected].tolist(), weights[selected].tolist()):
+				if i == j:
+					continue
+				key = i * n + j if i < j else j * n + i
+				if key not in self.fixed:
+					self.fixed[key] = w
+				total += self.fixed[key]
+		return total
+
+	def ordered_coherence(self, aset):
+		"""
+		sum_x sum_ (y not x) w(x, y) over x, y in aset, summed in the order of aset
+		(the same float as comp_coherence on a weight dic with the same weights)
+		"""
+		genes = list(aset)
+		n = len(self.graph)
+		mask = self.graph.member_mask(genes)
+		order = dict([(i, p) for (p, i) in enumerate(self.graph.ids(genes).tolist())])
+		sums = []
+		for x in genes:
+			if x not in self.graph:
+				sums.append(0)
+				continue
+			i = self.graph.gene_idx[x]
+			(cols, weights) = self.graph.row(x)
+			selected = mask[cols]
+			entries = []
+			for (j, w) in zip(cols[selected].tolist(), weights[selected].tolist()):
+				if i == j:
+					continue
+				key = i * n + j if i < j else j * n + i
+				if key not in self.fixed:
+					self.fixed[key] = w
+				entries.append((order[j], self.fixed[key]))
+			## pairs without a score (weight 0) do not change the sums
+			entries.sort()
+			sums.append(sum([w for (_, w) in entries]))
+		return sum(sums)
+
+	def visit(self, set_a, set_b):
+		"""
+		fix the weights of the pairs x in set_a, y in set_b not visited yet (see update_w_dic)
+		"""
+		self.sum_weights(set_a, set_b)
+
 def find_best_gene_module_pair(modules, G, gm_dic, m_dic):
 	""" compute the between cost of every pair of modules
 	and pick a pair with the maximum cost > 0
@@ -134,9 +295,11 @@ def find_best_module_pair(modules, mcost_dic):
 	return (max_pair[0], max_pair[1], max_cost)
 
 ## compute module cost (all modules and all possible merged modules)
-def comp_mcost_all(modules, G, wdic, score_dics, coefs, th):
+def comp_mcost_all(modules, G, wdic, score_dics, coefs, th, tcoh_dic=None, cross_dic=None):
 	"""
 	mcost_dic[i][j] = mcost(mi+mj)
+	(modules are disjoint, mcost(mi+mj) is computed from the total coherence of mi, mj
+	and the weights between them, see mcost_from_coherence)
 	Parameters:
 		modules
 		G: Graph (necessary for optimizations - costs are computed only if two modules have neighbors)
@@ -144,37 +307,67 @@ def comp_mcost_all(modules, G, wdic, score_dics, coefs, th):
 		score_dics:  list of interaction scores
 		coef
 		th
-		g
+		tcoh_dic: (optional) dic to store total coherence of each module tcoh_dic[i]
+		cross_dic: (optional) dic to store weights between modules cross_dic[i][j]
 	Returns:
 		cost_dic: between module cost
 	"""
+	if tcoh_dic is None:
+		tcoh_dic = {}
+	if cross_dic is None:
+		cross_dic = {}
 	mcost_dic = {}
 	for m in modules:
 		wdic = update_w_dic(wdic, m, m, score_dics, coefs)
+	# gene -> indices of the modules including it
+	gene_modules = {}
+	for j in range(len(modules)):
+		for g in modules[j]:
+			gene_modules.setdefault(g, set([])).add(j)
+	for i in range(len(modules)):
+		tcoh_dic[i] = comp_coherence(modules[i], wdic)
+		cross_dic[i] = {}
 	for i in range(len(modules)):
 		mcost_dic[i] = {}
 		m1 = modules[i]
-		mcost_dic[i][i] = comp_mcost(m1, wdic, th)
-		for j in range(len(modules)):
+		mcost_dic[i][i] = mcost_from_coherence(len(m1), tcoh_dic[i], th)
+		# modules including a neighbor of m1 (in the order of module indices)
+		neigh_modules = set([])
+		for g in misc.neighbors(G, m1):
+			neigh_modules.update(gene_modules.get(g, []))
+		for j in sorted(neigh_modules):
 			m2 = modules[j]
-			if i == j or len(set(misc.neighbors(G, m1)).intersection(m2)) == 0:
+			if i == j:
 				continue
-			wdic = update_w_dic(wdic, m1, m2, score_dics, coefs)
-			mcost_dic[i][j] = comp_mcost(set(m1).union(m2), wdic, th)
+			if j not in cross_dic[i]:
+				cross_dic[i][j] = comp_cross_weight(m1, m2, wdic, score_dics, coefs)
+				cross_dic[j][i] = cross_dic[i][j]
+			tcoh = tcoh_dic[i] + tcoh_dic[j] + 2 * cross_dic[i][j]
+			mcost_dic[i][j] = mcost_from_coherence(len(m1) + len(m2), tcoh, th)
 	return mcost_dic
 
-def comp_gmcost_all(modules, G, wdic, th):
+def comp_gmcost_all(modules, G, wdic, score_dics, coefs, th, tcoh_dic=None, gsum_dic=None):
 	"""
 	gmcost_dic[i][g] = mcost(mi+g)
 	mcost_dic[i] = mcost(mi)
+	(computed from the total coherence of mi and the sum of weights from g to mi)
 	Parameters:
 		modules
 		G
 		wdic (computed based on score_dics, coefs)
+		score_dics:  list of interaction scores
+		coefs
+		th
+		tcoh_dic: (optional) dic to store total coherence of each module tcoh_dic[i]
+		gsum_dic: (optional) dic to store weights from g to module i (g excluded) gsum_dic[i][g]
 	Returns:
 		gmcost_dic
 		mcost_dic
 	"""
+	if tcoh_dic is None:
+		tcoh_dic = {}
+	if gsum_dic is None:
+		gsum_dic = {}
 	gmcost_dic = {}
 	mcost_dic = {}
 	all_genes = []
@@ -182,16 +375,35 @@ def comp_gmcost_all(modules, G, wdic, th):
 		all_genes.extend(m)
 	for i in range(len(modules)):
 		m1 = modules[i]
-		mcost_dic[i] = comp_mcost(m1, wdic, th)
+		wdic = update_w_dic(wdic, m1, m1, score_dics, coefs)
+		tcoh_dic[i] = comp_coherence(m1, wdic)
+		mcost_dic[i] = mcost_from_coherence(len(m1), tcoh_dic[i], th)
 
 		gmcost_dic[i] = {}
+		gsum_dic[i] = {}
 		neighbors = set(all_genes).intersection(misc.neighbors(G, m1))
 		if i == 57:
 			print(neighbors)
+		members = set(m1)
 		for g in neighbors:
-			gmcost_dic[i][g] = comp_mcost(set(m1).union([g]), wdic, th)
+			gsum_dic[i][g] = comp_cross_weight([g], members.difference([g]), wdic, score_dics, coefs)
+			gmcost_dic[i][g] = comp_gmcost(members, g, tcoh_dic[i], gsum_dic[i][g], th)
 	return (mcost_dic, gmcost_dic)
 
+def comp_gmcost(members, g, tcoh, gsum, th):
+	"""
+	mcost(m+g) from the total coherence tcoh of m and the weights gsum from g to m
+	Parameters:
+		members: set of genes in m
+		g
+		tcoh
+		gsum
+		th
+	"""
+	if g in members:
+		return mcost_from_coherence(len(members), tcoh, th)
+	return mcost_from_coherence(len(members) + 1, tcoh + 2 * gsum, th)
+
 def comp_between_cost_all(modules, G, wdic, score_dics, coefs, g=None):
 	""" compute the between cost of every pair of modules
 	cost_dic[i][j] = sum(wdic[x][y] for all x,y)/len(modules(i))*len(modules(j)) (see comp_between_cost)
@@ -225,9 +437,55 @@ def comp_between_cost(m1, m2, wdic):
 	""" compute the cost between two modules
 	"""
 	total_cost = 0
-	total_cost = sum([sum([wdic[x][y] for y in m2]) for x in m1])
+	if isinstance(wdic, WeightMatrix):
+		total_cost = wdic.sum_weights(m1, m2)
+	else:
+		total_cost = sum([sum([wdic[x][y] for y in m2]) for x in m1])
 	return total_cost / (len(m1) * len(m2))
 
+def pair_gain_entry(mcost_dic, scan_pos, version, i, j):
+	""" heap entry of module pair (i, j) (see merge_modules)
+	gain = mcost(mi) + mcost(mj) - mcost(mi+mj) as in find_best_module_pair,
+	ties broken by the order scanned in find_best_module_pair
+	"""
+	gain = mcost_dic[i][i] + mcost_dic[j][j] - mcost_dic[i][j]
+	return (-gain, i, scan_pos[i][j], j, version[i], version[j])
+
+def gene_gain_entry(mcost_dic, gmcost_dic, scan_pos, version, i, g):
+	""" heap entry of (gene, module) pair (g, i) (see overlap_modules)
+	gain = 1 + mcost(mi) - mcost(mi+g) as in find_best_gene_module_pair,
+	ties broken by the order scanned in find_best_gene_module_pair
+	"""
+	gain = 1 + mcost_dic[i] - gmcost_dic[i][g]
+	return (-gain, i, scan_pos[i][g], g, version[i])
+
+def pop_best_entry(heap, is_valid, exact_gain):
+	""" pop the entry with the maximum gain from a heap of (-gain, i, scan position, ...)
+	(see merge_modules, overlap_modules)
+	gains in the heap are computed from cached aggregates, so the entries within a small tolerance
+	of the top are compared by exact_gain(entry), the gain summed pair by pair as in
+	find_best_module_pair (find_best_gene_module_pair), with ties broken in their scan order
+	stale entries (is_valid(entry) is False) are dropped, and the other candidates are pushed back
+	Returns:
+		entry, exact gain ((None, -1) if there is no entry)
+	"""
+	while len(heap) > 0 and not is_valid(heap[0]):
+		hq.heappop(heap)
+	if len(heap) == 0:
+		return (None, -1)
+	top = -heap[0][0]
+	tol = 1e-9 * (1 + abs(top))
+	candidates = []
+	while len(heap) > 0 and -heap[0][0] >= top - tol:
+		entry = hq.heappop(heap)
+		if is_valid(entry):
+			candidates.append(entry)
+	best = min(candidates, key=lambda e: (-exact_gain(e), e[1], e[2]))
+	for entry in candidates:
+		if entry is not best:
+			hq.heappush(heap, entry)
+	return (best, exact_gain(best))
+
 ### functions for post processing
 def merge_modules(modules, alpha2, G, wdic, score_dics, coefs, th):
 	""" merge modules after obtaining modules from module_cover
@@ -246,17 +504,59 @@ def merge_modules(modules, alpha2, G, wdic, score_dics, coefs, th):
 	## compute module cost (all modules and all possible merged modules)
 	old_modules = modules
 	modules = [list(m) for m in old_modules]  ## make a copy
-	mcost_dic = comp_mcost_all(modules, G, wdic, score_dics, coefs, th)
+	if sum([len(set(m)) for m in modules]) != len(set([g for m in modules for g in m])):
+		raise ValueError("modules to merge should be disjoint")
+	## tcoh_dic[i]: total coherence of mi, cross_dic[i][j]: weights between mi and mj
+	(tcoh_dic, cross_dic) = ({}, {})
+	mcost_dic = comp_mcost_all(modules, G, wdic, score_dics, coefs, th, tcoh_dic, cross_dic)
+	## all pairs in a heap of (-score, i, scan position, j, versions) instead of scanning mcost_dic
+	## scan_pos[i][j]: position of j in mcost_dic[i] (dict order, i.e., the order scanned
+	## in find_best_module_pair, so ties are broken in the same way)
+	## an entry is stale once a module is merged (its version is increased or it is removed)
+	version = [0] * len(modules)
+	scan_pos = dict([(i, dict([(j, p) for p, j in enumerate(mcost_dic[i])])) for i in mcost_dic])
+	pair_heap = [pair_gain_entry(mcost_dic, scan_pos, version, i, j)
+				for i in mcost_dic for j in mcost_dic[i] if i != j]
+	hq.heapify(pair_heap)
+	## exact costs (summed pair by pair as comp_mcost_all) to choose among (almost) tied pairs:
+	## exact_dic[i]: mcost(mi), exact_dic[(i, j, version[i], version[j])]: score of the pair
+	## orient[(i, j)] (i < j): mcost(mi+mj) is summed over set(m_a).union(m_b) for (a, b) = orient[(i, j)]
+	## once recomputed after a merge, otherwise over set(mi).union(mj) for the pair (i, j)
+	(exact_dic, orient) = ({}, {})
+
+	def is_valid(entry):
+		(_, i1, _, i2, v1, v2) = entry
+		return i1 in mcost_dic and i2 in mcost_dic and version[i1] == v1 and version[i2] == v2
+
+	def exact_mcost(i):
+		if i not in exact_dic:
+			exact_dic[i] = comp_exact_mcost(modules[i], wdic, th)
+		return exact_dic[i]
+
+	def exact_gain(entry):
+		(_, i, _, j, vi, vj) = entry
+		if (i, j, vi, vj) not in exact_dic:
+			(a, b) = orient.get((min(i, j), max(i, j)), (i, j))
+			merged = comp_exact_mcost(set(modules[a]).union(modules[b]), wdic, th)
+			exact_dic[(i, j, vi, vj)] = (exact_mcost(i) + exact_mcost(j) - merged, merged)
+		return exact_dic[(i, j, vi, vj)][0]
+
 	while True:
 		## score =  (mcost(m1) + mcost(m2)) - mcost(m1+m2)
-		(m1, m2, score) = find_best_module_pair(modules, mcost_dic)
+		(entry, score) = pop_best_entry(pair_heap, is_valid, exact_gain)
+		## as find_best_module_pair, only pairs with score > -1 are considered
+		if score <= -1:
+			score = -1
 		print(score)
-		if score <= -alpha2:
+		if score <= -alpha2 or score == -1:
 			break
 		else:
-			i1 = modules.index(m1)
-			i2 = modules.index(m2)
+			(_, i1, _, i2, v1, v2) = entry
+			exact_dic[i1] = exact_dic[(i1, i2, v1, v2)][1]
+			(m1, m2) = (modules[i1], modules[i2])
 			sys.stderr.write("(%s) and (%s) are merged (cost %f)\n" % (",".join(m1), ",".join(m2), score))
+			(old1, old2) = (list(m1), list(m2))
+			tcoh_dic[i1] += tcoh_dic[i2] + 2 * cross_dic[i1][i2]
 			modules[i1].extend(m2)
 			modules[i2] = []
 			mcost_dic[i1][i1] = mcost_dic[i1][i2]  ## new mcost(mi)
@@ -265,12 +565,33 @@ def merge_modules(modules, alpha2, G, wdic, score_dics, coefs, th):
 			for i in set(mcost_dic[i1]).union(mcost_dic[i2]):
 				if i == i1 or i == i2:
 					continue
-				wdic = update_w_dic(wdic, modules[i], modules[i1], score_dics, coefs)
-				mcost_dic[i][i1] = comp_mcost(set(modules[i]).union(modules[i1]), wdic, th)
+				## weights from mi to mi1 + mi2 (computed if not cached)
+				cross = 0
+				for (j, old) in [(i1, old1), (i2, old2)]:
+					if i in cross_dic[j]:
+						cross += cross_dic[j][i]
+					else:
+						cross += comp_cross_weight(modules[i], old, wdic, score_dics, coefs)
+				cross_dic[i][i1] = cross_dic[i1][i] = cross
+				cross_dic[i].pop(i2, None)
+				tcoh = tcoh_dic[i] + tcoh_dic[i1] + 2 * cross
+				mcost_dic[i][i1] = mcost_from_coherence(len(modules[i]) + len(modules[i1]), tcoh, th)
 				mcost_dic[i1][i] = mcost_dic[i][i1]
+				orient[(min(i, i1), max(i, i1))] = (i, i1)
+				## new keys are scanned last
+				scan_pos[i].setdefault(i1, len(scan_pos[i]))
+				scan_pos[i1].setdefault(i, len(scan_pos[i1]))
 				if i2 in mcost_dic[i]:
 					del mcost_dic[i][i2]
 			del mcost_dic[i2]
+			del cross_dic[i2]
+			cross_dic[i1].pop(i2, None)
+			## pairs with mi1 (its cost changed)
+			version[i1] += 1
+			for i in mcost_dic[i1]:
+				if i != i1:
+					hq.heappush(pair_heap, pair_gain_entry(mcost_dic, scan_pos, version, i1, i))
+					hq.heappush(pair_heap, pair_gain_entry(mcost_dic, scan_pos, version, i, i1))
 	new_modules = list(filter(lambda x: len(x) > 0, modules))
 	return (new_modules, mcost_dic)
 
@@ -291,23 +612,61 @@ def overlap_modules(modules, alpha3, G, wdic, score_dics, coefs, th):
 		new_modules: overlapped modules
 	"""
 	new_modules = [list(m) for m in modules]
-	(mcost_dic, gmcost_dic) = comp_gmcost_all(modules, G, wdic, th)
+	## tcoh_dic[i]: total coherence of mi, gsum_dic[i][g]: weights from g to mi
+	(tcoh_dic, gsum_dic) = ({}, {})
+	(mcost_dic, gmcost_dic) = comp_gmcost_all(modules, G, wdic, score_dics, coefs, th, tcoh_dic, gsum_dic)
+	## all (gene, module) candidates in a heap of (-score, i, scan position, g, version)
+	## instead of scanning gmcost_dic; scan_pos[i][g]: position of g in gmcost_dic[i]
+	## (ties are broken as in find_best_gene_module_pair)
+	## only the candidates of the module a gene is added to are re-scored (its version is increased)
+	## mcost_dic keeps the cost of the initial modules (as in find_best_gene_module_pair)
+	members = [set(m) for m in new_modules]
+	version = [0] * len(new_modules)
+	scan_pos = dict([(i, dict([(g, p) for p, g in enumerate(gmcost_dic[i])])) for i in gmcost_dic])
+	gain_heap = [gene_gain_entry(mcost_dic, gmcost_dic, scan_pos, version, i, g)
+				for i in gmcost_dic for g in gmcost_dic[i] if g not in members[i]]
+	hq.heapify(gain_heap)
+	## exact costs (summed pair by pair as comp_gmcost_all) to choose among (almost) tied candidates:
+	## exact_dic[i]: mcost(mi) of the initial module, exact_dic[(i, g, version[i])]: score of the candidate
+	exact_dic = {}
+
+	def is_valid(entry):
+		(_, i, _, g, v) = entry
+		return version[i] == v and g in gmcost_dic[i]
+
+	def exact_gain(entry):
+		(_, i, _, g, v) = entry
+		if i not in exact_dic:
+			exact_dic[i] = comp_exact_mcost(modules[i], wdic, th)
+		if (i, g, v) not in exact_dic:
+			exact_dic[(i, g, v)] = 1 + exact_dic[i] - comp_exact_mcost(set(new_modules[i]).union([g]), wdic, th)
+		return exact_dic[(i, g, v)]
 
 	while True:
-		(g, m, score) = find_best_gene_module_pair(new_modules, G, gmcost_dic, mcost_dic)
+		(entry, score) = pop_best_entry(gain_heap, is_valid, exact_gain)
+		## as find_best_gene_module_pair, only pairs with score > -1 are considered
+		if score <= -1:
+			score = -1
 		print(score)
-		if score <= -alpha3:
+		if score <= -alpha3 or score == -1:
 			break
 		else:
-			mid = new_modules.index(m)
+			(_, mid, _, g, _) = entry
+			m = new_modules[mid]
 			sys.stderr.write("(%s) is added to (%s) (cost %f)\n" % (g, ",".join(m), score))
-			wdic = update_w_dic(wdic, [g], misc.neighbors(G, m), score_dics, coefs)
-			wdic = update_w_dic(wdic, m, misc.neighbors(G, [g]), score_dics, coefs)
+			tcoh_dic[mid] += 2 * gsum_dic[mid][g]
 			new_modules[mid].append(g)
+			members[mid].add(g)
 			del gmcost_dic[mid][g]
+			version[mid] += 1
+			## re-score the candidates of mid (genes in mid are not candidates)
+			## (candidates are neighbors of mid, weights from g are filled as update_w_dic([g], neighbors))
 			for g2 in gmcost_dic[mid]:
-				wdic = update_w_dic(wdic, [g2], new_modules[mid], score_dics, coefs)
-				gmcost_dic[mid][g2] = comp_mcost(set(new_modules[mid]).union([g2]), wdic, th)
+				if g2 in members[mid]:
+					continue
+				gsum_dic[mid][g2] += comp_cross_weight([g], [g2], wdic, score_dics, coefs)
+				gmcost_dic[mid][g2] = comp_gmcost(members[mid], g2, tcoh_dic[mid], gsum_dic[mid][g2], th)
+				hq.heappush(gain_heap, gene_gain_entry(mcost_dic, gmcost_dic, scan_pos, version, mid, g2))
 	return new_modules
 
 
@@ -1,18 +1,29 @@
 #!/usr/bin/python
 # compute mutual exclusivity rank with permutation test
 
+import os
+import re
+import math
+import itertools
 import logging
 import numpy as np
+import pandas
+
+from utils.mut_matrix import MutMatrix, pack_rows, unpack_rows, popcount, popcount_words
 
 
 def comp_type_dic(original_gene_dic, type_idx_dic):
 	"""
 	divide the given mut_dic into each type
-	:param original_gene_dic: gene-> set of covered samples
+	:param original_gene_dic: gene-> set of covered samples (or MutMatrix)
 	:param type_idx_dic: cancer type -> set of samples
 	:return:original_gene_type_dic: cancer type -> gene -> set of covered samples
+			(cancer type -> MutMatrix restricted to the type if MutMatrix is given)
 	"""
 
+	if isinstance(original_gene_dic, MutMatrix):
+		return dict([(can, original_gene_dic.masked(type_idx_dic[can])) for can in type_idx_dic])
+
 	original_gene_type_dic = {}
 	for can in type_idx_dic:
 		temp_dic = {}
@@ -28,11 +39,17 @@ def comp_pair_cover(gene_mut_dic, pairs):
 	"""
 	given a mut_dic, compute the size of cover for each pair
 	if either gene does not exist, cover size is 0
-	:param gene_mut_dic: gene -> list of covered samples
+	:param gene_mut_dic: gene -> list of covered samples (or MutMatrix)
 	:param pairs: list of gene pairs
 	:return:
 		cover_size_list: cover sizes in the same order as pairs
 	"""
+	if isinstance(gene_mut_dic, MutMatrix):
+		# popcount(a|b) on packed bitsets
+		(idx1, idx2) = edge_index(gene_mut_dic, pairs)
+		cover_sizes = batch_pair_cover(gene_mut_dic.bits, idx1, idx2, gene_mut_dic.present)
+		return cover_sizes.tolist()
+
 	cover_size_list = []
 
 	for pair in pairs:
@@ -46,6 +63,208 @@ def comp_pair_cover(gene_mut_dic, pairs):
 	return cover_size_list
 
 
+def edge_index(gene_mut_dic, pairs):
+	"""
+	convert gene pairs to row indices of a MutMatrix
+	:param gene_mut_dic: MutMatrix
+	:param pairs: list of gene pairs
+	:return:
+		idx1, idx2: int arrays of row indices in the same order as pairs
+			(-1 if the gene does not exist)
+	"""
+	gene_idx = gene_mut_dic.gene_idx
+	idx1 = np.array([gene_idx.get(x, -1) for (x, y) in pairs], dtype=np.int64)
+	idx2 = np.array([gene_idx.get(y, -1) for (x, y) in pairs], dtype=np.int64)
+	return idx1, idx2
+
+
+def batch_pair_cover(bits, idx1, idx2, present=None, chunk_size=4096):
+	"""
+	compute the size of cover for all pairs in one pass
+	cover(x, y) = popcount(bits[x] | bits[y]), 0 if either gene does not exist
+	:param bits: ngenes x nwords packed bitsets (uint64) or ngenes x nsamples boolean matrix
+	:param idx1: row indices of the first genes (see edge_index)
+	:param idx2: row indices of the second genes
+	:param present: (optional) boolean array, False for genes regarded as non-existing
+	:param chunk_size: number of pairs processed at a time (bounds the memory)
+	:return: cover_sizes: int32 array, cover sizes in the same order as pairs
+	"""
+	bits = np.asarray(bits)
+	if bits.dtype == bool:
+		bits = pack_rows(bits)
+	idx1, idx2 = np.asarray(idx1), np.asarray(idx2)
+	valid = (idx1 >= 0) & (idx2 >= 0)
+	idx1, idx2 = np.where(valid, idx1, 0), np.where(valid, idx2, 0)
+	if present is not None:
+		valid &= present[idx1] & present[idx2]
+
+	npairs = len(idx1)
+	cover_sizes = np.zeros(npairs, dtype=np.int32)
+	for start in range(0, npairs, chunk_size):
+		end = min(start + chunk_size, npairs)
+		cover_sizes[start:end] = popcount(bits[idx1[start:end]] | bits[idx2[start:end]])
+
+	cover_sizes[~valid] = 0
+	return cover_sizes
+
+
+def comp_type_blocks(type_idx_dic, cancers, nsamples):
+	"""
+	layout of type-segmented bitsets
+	samples of each cancer type (in the order of cancers) form a contiguous block of words
+	(each block is padded to a word boundary); samples of none of the types form the last block
+	:param type_idx_dic: cancer type -> list of sample indices
+	:param cancers: cancer types (block order)
+	:param nsamples: number of samples
+	:return:
+		block_idxs: list of sample indices for each block (len(cancers)+1 blocks)
+		block_starts: int array, word offset of each block (the last element is the total number of words)
+	"""
+	typed = set([])
+	block_idxs = []
+	for can in cancers:
+		block_idxs.append(list(type_idx_dic[can]))
+		typed.update(type_idx_dic[can])
+	block_idxs.append([i for i in range(nsamples) if i not in typed])
+	block_words = [(len(idxs) + 63) // 64 for idxs in block_idxs]
+	block_starts = np.concatenate([[0], np.cumsum(block_words)]).astype(np.int64)
+	return block_idxs, block_starts
+
+
+def segment_type_blocks(gene_mut_dic, block_idxs):
+	"""
+	reorder the samples of a MutMatrix into type-segmented bitsets (see comp_type_blocks)
+	:param gene_mut_dic: MutMatrix
+	:param block_idxs: list of sample indices for each block
+	:return: bits: ngenes x nwords uint64 array
+	"""
+	rows = gene_mut_dic.to_bool()
+	return np.hstack([pack_rows(rows[:, idxs]) for idxs in block_idxs])
+
+
+def batch_type_cover(bits, block_starts, idx1, idx2, present=None, chunk_size=8192):
+	"""
+	compute the size of cover within each block (cancer type) for all pairs in one pass
+	cover(x, y) in a block = popcount of (bits[x] | bits[y]) over the words of the block
+	raw cover sizes are the row sums, 0 if either gene does not exist
+	:param bits: type-segmented bitsets (see segment_type_blocks)
+	:param block_starts: word offset of each block (see comp_type_blocks)
+	:param idx1: row indices of the first genes (see edge_index)
+	:param idx2: row indices of the second genes
+	:param present: (optional) boolean array, False for genes regarded as non-existing
+	:param chunk_size: number of pairs processed at a time (bounds the memory)
+	:return: block_cover_sizes: npairs x nblocks int32 array
+	"""
+	idx1, idx2 = np.asarray(idx1), np.asarray(idx2)
+	valid = (idx1 >= 0) & (idx2 >= 0)
+	idx1, idx2 = np.where(valid, idx1, 0), np.where(valid, idx2, 0)
+	if present is not None:
+		valid &= present[idx1] & present[idx2]
+
+	npairs = len(idx1)
+	block_cover_sizes = np.zeros((npairs, len(block_starts)-1), dtype=np.int32)
+	for start in range(0, npairs, chunk_size):
+		end = min(start + chunk_size, npairs)
+		word_counts = popcount_words(bits[idx1[start:end]] | bits[idx2[start:end]])
+		# cumulative counts over words; a block is the difference at its boundaries
+		cum_counts = np.zeros((end-start, word_counts.shape[1]+1), dtype=np.int32)
+		np.cumsum(word_counts, axis=1, dtype=np.int32, out=cum_counts[:, 1:])
+		block_cover_sizes[start:end] = cum_counts[:, block_starts[1:]] - cum_counts[:, block_starts[:-1]]
+
+	block_cover_sizes[~valid] = 0
+	return block_cover_sizes
+
+
+def top_altered_genes(gene_mut_dic, k):
+	"""
+	row indices of the k most altered genes (ties in the order of genes)
+	:param gene_mut_dic: MutMatrix
+	:param k: number of genes
+	:return: int array of row indices (genes covering no sample are excluded)
+	"""
+	degrees = np.where(gene_mut_dic.present, gene_mut_dic.degrees(), 0)
+	order = np.argsort(-degrees, kind="stable")
+	return order[degrees[order] > 0][:k]
+
+
+def all_pair_index(rows):
+	"""
+	all pairs of the given rows in the order of the upper triangle (row by row, see all_pair_tiles)
+	:param rows: row indices of genes
+	:return: (idx1, idx2): row indices of the first and second genes of each pair
+	"""
+	rows = np.asarray(rows)
+	(iu1, iu2) = np.triu_indices(len(rows), 1)
+	return rows[iu1], rows[iu2]
+
+
+def all_pair_tiles(nrows, tile_size=256):
+	"""
+	tiles of the upper triangle of an nrows x nrows matrix (row block x column block)
+	:param nrows: number of rows (genes)
+	:param tile_size: number of rows and columns of a tile
+	:return: generator of (r0, r1, c0, c1): rows r0..r1-1 and columns c0..c1-1 (c0 >= r0)
+	"""
+	for r0 in range(0, nrows, tile_size):
+		for c0 in range(r0, nrows, tile_size):
+			yield r0, min(r0 + tile_size, nrows), c0, min(c0 + tile_size, nrows)
+
+
+def tile_pair_index(nrows, tile):
+	"""
+	pairs (i, j), i < j, within a tile and their positions in the order of all_pair_index
+	:param nrows: number of rows (genes)
+	:param tile: (r0, r1, c0, c1) (see all_pair_tiles)
+	:return: (pos, ii, jj): positions (increasing), and tile-local row and column indices of the pairs
+	"""
+	(r0, r1, c0, c1) = tile
+	(ii, jj) = np.meshgrid(np.arange(r0, r1), np.arange(c0, c1), indexing="ij")
+	upper = ii < jj
+	(ii, jj) = (ii[upper], jj[upper])
+	pos = ii * nrows - ii * (ii + 1) // 2 + jj - ii - 1
+	return pos, ii - r0, jj - c0
+
+
+def all_pair_vectors(bits, block_starts, rows):
+	"""
+	0/1 sample vectors of the given genes within each block (cancer type) for all_pair_cover
+	:param bits: type-segmented bitsets (see segment_type_blocks)
+	:param block_starts: word offset of each block (see comp_type_blocks)
+	:param rows: row indices of the genes
+	:return: (vectors, degrees): list of nrows x nsamples float32 arrays (one for each block)
+			and nrows x nblocks number of altered samples within each block
+	"""
+	row_bits = bits[np.asarray(rows)]
+	vectors = []
+	for b in range(len(block_starts)-1):
+		(start, end) = (block_starts[b], block_starts[b+1])
+		# counts are exact in float32 (< 2^24 samples)
+		vectors.append(unpack_rows(row_bits[:, start:end], 64*(end-start)).astype(np.float32))
+	degrees = np.column_stack([x.sum(axis=1) for x in vectors]).astype(np.int32)
+	return vectors, degrees
+
+
+def all_pair_cover(vectors, degrees, tile, ii, jj, present=None):
+	"""
+	compute the size of cover within each block (cancer type) for pairs in a tile
+	cover(x, y) = |A(x)| + |A(y)| - |A(x) & A(y)|, where the intersections of the pairs
+	in a block form a tile of the Gram matrix of the 0/1 sample vectors (one matrix multiply per block)
+	:param vectors, degrees: see all_pair_vectors
+	:param tile: (r0, r1, c0, c1) (see all_pair_tiles)
+	:param ii, jj: tile-local row and column indices of the pairs (see tile_pair_index)
+	:param present: (optional) boolean array over the genes of vectors, False for genes regarded as non-existing
+	:return: block_cover_sizes: npairs x nblocks int32 array
+	"""
+	(r0, r1, c0, c1) = tile
+	block_cover_sizes = degrees[r0:r1][ii] + degrees[c0:c1][jj]
+	for b in range(len(vectors)):
+		gram = vectors[b][r0:r1].dot(vectors[b][c0:c1].T)
+		block_cover_sizes[:, b] -= gram[ii, jj].astype(np.int32)
+	if present is not None:
+		block_cover_sizes[~(present[r0:r1][ii] & present[c0:c1][jj])] = 0
+	return block_cover_sizes
+
+
 def norm_cover_size(type_cover_list, coefs):
 	"""
 	compute normalized sum of each element
@@ -71,36 +290,381 @@ def update_rank(rank_list, original_cover_size_list, permuted_cover_size_list, e
 	:param original_cover_size_list: list of original cover sizes
 	:param permuted_cover_size_list: list of permuted cover sizes
 	:param ep: epsilon for numerical precision error (conservatively compute the rank)
-	:return: rank_list: updated rank list (new)
+	:return: rank_list: updated rank list (new array)
 	"""
 
 	llen = len(original_cover_size_list) # length of the list
 	if llen != len(permuted_cover_size_list):
 		logging.warning("two lists have different sizes\n")
-	temp_ranks = [int(original_cover_size_list[i] <= permuted_cover_size_list[i] + ep) for i in range(llen)]
-	rank_list = [x+y for x, y in zip(temp_ranks, rank_list)]
+	temp_ranks = np.asarray(original_cover_size_list) <= np.asarray(permuted_cover_size_list) + ep
+	rank_list = np.asarray(rank_list) + temp_ranks
 
 	return rank_list
 
 
+def rank_labels(ptype, cancers):
+	"""
+	labels of the rank columns
+	:param ptype: permutaion type (tr or to)
+	:param cancers: cancer types
+	:return: ["raw_me_rank"] for to, ["raw_me_rank", "norm_me_rank", can+"_me_rank", ...] for tr
+	"""
+	labels = ["raw_me_rank"]
+	if ptype == "tr":
+		labels += ["norm_me_rank"]+[can+"_me_rank" for can in cancers]
+	return labels
+
+
+def comp_cover_columns(block_cover_sizes, coefs=None, out=None):
+	"""
+	cover sizes in the column order of the rank table (see rank_labels)
+	:param block_cover_sizes: edges x blocks cover sizes (see batch_type_cover)
+	:param coefs: normalizing coefficient for each cancer type, in block order (None for to)
+	:param out: (optional) preallocated edges x ncols float array
+	:return: edges x ncols array: raw cover sizes (to)
+			or raw, normalized and per type cover sizes (tr)
+	"""
+	ncols = 1 if coefs is None else len(coefs)+2
+	if out is None:
+		out = np.empty((len(block_cover_sizes), ncols))
+	np.sum(block_cover_sizes, axis=1, out=out[:, 0])
+	if coefs is not None:
+		ntypes = len(coefs)
+		out[:, 1] = block_cover_sizes[:, :ntypes].dot(coefs)
+		out[:, 2:] = block_cover_sizes[:, :ntypes]
+	return out
+
+
+class RankAccumulator(object):
+	"""
+	ranks of original cover sizes accumulated over permuted instances
+	ranks[e][c] = number of permutations where original[e][c] <= permuted[e][c] + ep
+	(same as update_rank, updated in place without allocating per permutation)
+
+	original: edges x ncols original cover sizes (see comp_cover_columns), None if loaded for merging
+		or given with each update (see update_rows)
+	ranks: edges x ncols int32 array
+	labels: rank column labels (see rank_labels)
+	pnum: number of permuted instances accumulated
+	counts: number of permuted instances each edge was tested with
+		(less than pnum for edges stopped early, see update and stopped)
+	fids: ids of the permuted instances accumulated (if given in update)
+	"""
+
+	def __init__(self, original, labels, ep=1e-5, nedges=None):
+		"""
+		:param original: edges x ncols original cover sizes (or None)
+		:param labels: rank column labels
+		:param ep: epsilon for numerical precision error (see update_rank)
+		:param nedges: (optional) number of edges if original is None and ranks are updated by update_rows
+		"""
+		self.original = None if original is None else np.asarray(original, dtype=float)
+		self.labels = list(labels)
+		self.ep = ep
+		self.pnum = 0
+		self.fids = []
+		if self.original is not None:
+			self.ranks = np.zeros(self.original.shape, dtype=np.int32)
+			self.counts = np.zeros(self.original.shape[0], dtype=np.int32)
+			# buffers reused in every update
+			self._permuted = np.empty(self.original.shape)
+			self._temp_ranks = np.empty(self.original.shape, dtype=bool)
+		elif nedges is not None:
+			self.ranks = np.zeros((nedges, len(self.labels)), dtype=np.int32)
+			self.counts = np.zeros(nedges, dtype=np.int32)
+
+	def update(self, permuted, fid=None, rows=None):
+		"""
+		update ranks based on a new permuted instance
+		:param permuted: edges x ncols permuted cover sizes (len(rows) x ncols if rows is given)
+		:param fid: (optional) permutation file id of the instance
+		:param rows: (optional) indices of the edges tested with the instance (others are not updated)
+		"""
+		if rows is None:
+			np.add(permuted, self.ep, out=self._permuted)
+			np.less_equal(self.original, self._permuted, out=self._temp_ranks)
+			self.ranks += self._temp_ranks
+			self.counts += 1
+		else:
+			self.update_rows(permuted, rows)
+		self.count(fid)
+
+	def update_rows(self, permuted, rows, original=None):
+		"""
+		update the ranks of some edges based on a permuted instance (e.g., a tile of all pairs)
+		the instance is counted by count once all its edges are updated
+		:param permuted: len(rows) x ncols permuted cover sizes
+		:param rows: indices of the edges
+		:param original: (optional) len(rows) x ncols original cover sizes (if not kept in the accumulator)
+		"""
+		if original is None:
+			original = self.original[rows]
+		self.ranks[rows] += original <= permuted + self.ep
+		self.counts[rows] += 1
+
+	def count(self, fid=None):
+		"""
+		count a permuted instance (see update_rows)
+		:param fid: (optional) permutation file id of the instance
+		"""
+		self.pnum += 1
+		if fid is not None:
+			self.fids.append(fid)
+
+	def merge(self, other):
+		"""
+		add ranks accumulated over other permuted instances (e.g., another shard)
+		:param other: RankAccumulator with the same edges and labels
+		"""
+		if other.labels != self.labels or other.ranks.shape != self.ranks.shape:
+			raise ValueError("rank accumulators have different edges or columns")
+		self.ranks += other.ranks
+		self.counts += other.counts
+		self.pnum += other.pnum
+		self.fids += other.fids
+
+	def stopped(self, h, rows=None):
+		"""
+		edges whose ranks reached h in every column (Besag-Clifford sequential stopping)
+		their p-values are about h/counts, so they can be excluded from the remaining permutations
+		:param h: number of permuted cover sizes not smaller than the original to stop at
+		:param rows: (optional) indices of the edges to check
+		:return: boolean array (for all edges or rows)
+		"""
+		ranks = self.ranks if rows is None else self.ranks[rows]
+		return ranks.min(axis=1) >= h
+
+	def save(self, filename):
+		"""
+		write ranks, labels, the number of permutations (in total and per edge) and their ids in npz format
+		the file is replaced only after it is completely written (safe to use as a checkpoint)
+		"""
+		temp_file = filename + ".tmp"
+		with open(temp_file, "wb") as f:
+			np.savez(f, ranks=self.ranks, labels=np.array(self.labels), pnum=self.pnum,
+						counts=self.counts, fids=np.array(self.fids, dtype=np.int64))
+		os.replace(temp_file, filename)
+
+	@classmethod
+	def load(cls, filename, original=None, ep=1e-5):
+		"""
+		read ranks written by save
+		:param filename
+		:param original: original cover sizes (necessary only to continue updating)
+		:param ep: epsilon
+		:return: RankAccumulator
+		"""
+		data = np.load(filename)
+		acc = cls(original, [str(x) for x in data["labels"]], ep)
+		if original is not None and data["ranks"].shape != acc.ranks.shape:
+			raise ValueError("%s has different edges or columns" % filename)
+		acc.ranks = data["ranks"].astype(np.int32)
+		acc.pnum = int(data["pnum"])
+		if "counts" in data:
+			acc.counts = data["counts"].astype(np.int32)
+		else:
+			acc.counts = np.full(acc.ranks.shape[0], acc.pnum, dtype=np.int32)
+		acc.fids = [int(x) for x in data["fids"]] if "fids" in data else []
+		return acc
+
+	def to_frame(self, edges, counts=False, rows=None):
+		"""
+		rank table: gene1, gene2 followed by rank columns
+		:param edges: list of gene pairs (the order of the ranks, or of rows)
+		:param counts: add the number of permutations of each edge as the last column ("pnum")
+		:param rows: (optional) slice of the edges in the table (e.g., to write a large table in chunks)
+		:return: pandas data frame
+		"""
+		rows = slice(None) if rows is None else rows
+		(gene1, gene2) = zip(*edges) if len(edges) > 0 else ((), ())
+		all_ranks = pandas.DataFrame({"gene1": list(gene1), "gene2": list(gene2)})
+		for j in range(len(self.labels)):
+			all_ranks[self.labels[j]] = self.ranks[rows, j]
+		if counts:
+			all_ranks["pnum"] = self.counts[rows]
+		return all_ranks
+
+
+def block_degrees(bits, block_starts):
+	"""
+	number of altered samples of each gene within each block (cancer type)
+	:param bits: type-segmented bitsets (see segment_type_blocks)
+	:param block_starts: word offset of each block (see comp_type_blocks)
+	:return: ngenes x nblocks int32 array
+	"""
+	word_counts = popcount_words(bits)
+	cum_counts = np.zeros((word_counts.shape[0], word_counts.shape[1]+1), dtype=np.int32)
+	np.cumsum(word_counts, axis=1, dtype=np.int32, out=cum_counts[:, 1:])
+	return cum_counts[:, block_starts[1:]] - cum_counts[:, block_starts[:-1]]
+
+
+def weighted_overlap_moments(block_rows, deg1, deg2):
+	"""
+	mean, variance and third cumulant of the overlap of two genes within a block of samples
+	under the weighted sampling null: gene g is altered in sample s independently with
+	probability p(g, s) = min(1, a(g) d(s) / D) where a(g) is the number of altered samples of g,
+	d(s) is the number of altered genes of s and D is the total number of alterations
+	(the expected number of alterations of genes and samples are kept as in the permutations)
+	the overlap is a sum of Bernoulli(p(x, s) p(y, s)); sums over samples are computed from
+	prefix sums of the sorted sample degrees (no loop over samples)
+	:param block_rows: ngenes x nsamples boolean array (samples of the block)
+	:param deg1: number of altered samples of the first genes
+	:param deg2: number of altered samples of the second genes
+	:return: (mean, var, cum3): float arrays
+	"""
+	d = np.sort(block_rows.sum(axis=0)).astype(float)
+	total = d.sum()
+	deg1, deg2 = np.asarray(deg1, dtype=float), np.asarray(deg2, dtype=float)
+	if total == 0:
+		zeros = np.zeros(np.broadcast(deg1, deg2).shape)
+		return zeros, zeros, zeros
+	# prefix sums of d^m (m = 0..6)
+	prefix = np.zeros((7, len(d)+1))
+	for m in range(7):
+		np.cumsum(d ** m, out=prefix[m, 1:])
+	(alpha, beta) = (np.maximum(deg1, deg2) / total, np.minimum(deg1, deg2) / total)
+	with np.errstate(divide="ignore"):
+		# p(x, s) = 1 for samples from j1, p(y, s) = 1 for samples from j2
+		j1 = np.searchsorted(d, 1 / alpha)
+		j2 = np.searchsorted(d, 1 / beta)
+	# q(s) = alpha beta d^2 (before j1), beta d (j1 to j2), 1 (from j2)
+	moments = []
+	for m in range(1, 4):
+		moments.append((alpha * beta) ** m * prefix[2*m, j1] + beta ** m * (prefix[m, j2] - prefix[m, j1])
+						+ (len(d) - j2))
+	mean = moments[0]
+	var = moments[0] - moments[1]
+	cum3 = moments[0] - 3 * moments[1] + 2 * moments[2]
+	return mean, var, cum3
+
+
+def normal_cdf(z):
+	"""
+	standard normal cumulative distribution function (element-wise)
+	"""
+	z = np.asarray(z, dtype=float)
+	return 0.5 * np.frompyfunc(math.erfc, 1, 1)(-z / math.sqrt(2)).astype(float)
+
+
+def approx_lower_tail(x, mean, var, cum3, correction=0.5):
+	"""
+	P(X <= x) by the normal approximation refined with the skewness of X
+	:param x: observed values
+	:param mean, var, cum3: mean, variance and third cumulant of X
+	:param correction: continuity correction
+	:return: float array (1 if var is 0)
+	"""
+	sd = np.sqrt(np.maximum(var, 0))
+	safe_sd = np.where(sd > 0, sd, 1)
+	z = (x + correction - mean) / safe_sd
+	skew = cum3 / safe_sd ** 3
+	normal = normal_cdf(z)
+	cdf = normal + skew * (1 - z ** 2) * np.exp(-z ** 2 / 2) / (6 * math.sqrt(2 * math.pi))
+	# the correction is not valid far in the tail (negative probabilities)
+	cdf = np.where(cdf > 0, cdf, normal)
+	return np.where(sd > 0, np.clip(cdf, 0, 1), 1)
+
+
+def comp_analytic_pv(bits, block_starts, idx1, idx2, present=None, coefs=None):
+	"""
+	analytic p-values of mutual exclusivity (fast alternative to the permutation test)
+	p-value = P(overlap <= observed overlap) = P(cover >= observed cover) under the weighted sampling
+	null within each block (cancer type, see weighted_overlap_moments)
+	raw and normalized (weighted by coefs) p-values are for the sum over types
+	:param bits: type-segmented bitsets (see segment_type_blocks)
+	:param block_starts: word offset of each block (see comp_type_blocks)
+	:param idx1: row indices of the first genes (see edge_index)
+	:param idx2: row indices of the second genes
+	:param present: (optional) boolean array, False for genes regarded as non-existing
+	:param coefs: normalizing coefficient for each cancer type, in block order (None for to)
+	:return: edges x ncols array of p-values in the column order of the rank table (see rank_labels)
+			1 for pairs with a non-existing gene
+	"""
+	idx1, idx2 = np.asarray(idx1), np.asarray(idx2)
+	valid = (idx1 >= 0) & (idx2 >= 0)
+	idx1, idx2 = np.where(valid, idx1, 0), np.where(valid, idx2, 0)
+	if present is not None:
+		valid &= present[idx1] & present[idx2]
+
+	# degrees and overlaps within each block (edges x blocks)
+	degrees = block_degrees(bits, block_starts)
+	(deg1, deg2) = (degrees[idx1], degrees[idx2])
+	overlaps = deg1 + deg2 - batch_type_cover(bits, block_starts, idx1, idx2)
+	nblocks = len(block_starts)-1
+	(mean, var, cum3) = [np.zeros(overlaps.shape) for _ in range(3)]
+	for b in range(nblocks):
+		(start, end) = (block_starts[b], block_starts[b+1])
+		if start == end:
+			continue
+		block_rows = unpack_rows(bits[:, start:end], 64*(end-start))
+		(mean[:, b], var[:, b], cum3[:, b]) = weighted_overlap_moments(block_rows, deg1[:, b], deg2[:, b])
+
+	ncols = 1 if coefs is None else len(coefs)+2
+	pvs = np.ones((len(idx1), ncols))
+	pvs[:, 0] = approx_lower_tail(overlaps.sum(axis=1), mean.sum(axis=1), var.sum(axis=1), cum3.sum(axis=1))
+	if coefs is not None:
+		ntypes = len(coefs)
+		coefs = np.asarray(coefs, dtype=float)
+		# weighted sum of overlaps (not on the integer lattice, no continuity correction)
+		pvs[:, 1] = approx_lower_tail(overlaps[:, :ntypes].dot(coefs), mean[:, :ntypes].dot(coefs),
+									var[:, :ntypes].dot(coefs ** 2), cum3[:, :ntypes].dot(coefs ** 3), 0)
+		pvs[:, 2:] = approx_lower_tail(overlaps[:, :ntypes], mean[:, :ntypes], var[:, :ntypes], cum3[:, :ntypes])
+
+	pvs[~valid] = 1
+	return pvs
+
+
+def pv_labels(ptype, cancers):
+	"""
+	labels of the pvalue table
+	:param ptype: permutaion type (tr or to)
+	:param cancers: cancer types
+	:return: ["gene1", "gene2", "raw_pv"] for to, with "norm_pv", can+"_pv", ... for tr
+	"""
+	labels = ["gene1", "gene2", "raw_pv"]
+	if ptype == "tr":
+		labels += (["norm_pv"]+[can+"_pv" for can in cancers])
+	return labels
+
+
+def pv_frame(edges, pvs, ptype, cancers):
+	"""
+	pvalue table in the layout of comp_pv
+	:param edges: list of gene pairs
+	:param pvs: edges x ncols p-values (see comp_analytic_pv)
+	:param ptype: permutaion type (tr or to)
+	:param cancers: cancer types
+	:return: pandas data frame
+	"""
+	(gene1, gene2) = zip(*edges) if len(edges) > 0 else ((), ())
+	labels = pv_labels(ptype, cancers)
+	all_pvs = pandas.DataFrame({"gene1": list(gene1), "gene2": list(gene2)})
+	for j in range(len(labels)-2):
+		all_pvs[labels[j+2]] = pvs[:, j]
+	return all_pvs
+
+
 def comp_pv(all_ranks, ptype, pnum, cancers):
 	"""
 	compute p-values
 
 	:param all_ranks: pandas data frame
 	:param ptype: permutaion type (tr or to)
-	:param pnum: number of permutation instances
+	:param pnum: number of permutation instances (or array of the number for each edge)
+			ignored if all_ranks has a "pnum" column (adaptive test, see RankAccumulator.to_frame)
 	:param cancers: cancer type
 
-	:return: pvs: pvalues pandas data frame
+	:return: pvs: pvalues pandas data frame (with the "pnum" column of all_ranks if any)
 	"""
 	pvs = all_ranks.copy()
-	pv_labels = ["gene1", "gene2", "raw_pv"]
-	if ptype == "tr":
-		pv_labels += (["norm_pv"]+[can+"_pv" for can in cancers])
-	pvs.columns = pv_labels  # overwrite labels
-	pvs.iloc[:, 2:] += 1
-	pvs.iloc[:, 2:] /= float(pnum+1)
+	if "pnum" in pvs.columns:
+		pnum = pvs.pop("pnum")
+	labels = pv_labels(ptype, cancers)
+	pvs.columns = labels  # overwrite labels
+	denom = np.broadcast_to(np.asarray(pnum, dtype=float), (len(pvs),)) + 1
+	pvs[labels[2:]] = (pvs[labels[2:]] + 1).div(denom, axis=0)
+	if "pnum" in all_ranks.columns:
+		pvs["pnum"] = pnum
 
 	return pvs
 
@@ -117,10 +681,54 @@ def comp_logp(pvs, ptype, cancers):
 	:return: logps: pvalues pandas data frame
 	"""
 	logps = pvs.copy()
+	if "pnum" in logps.columns:
+		pnum = logps.pop("pnum")
 	logp_labels = ["gene1", "gene2", "raw_logp"]
 	if ptype == "tr":
 		logp_labels += (["norm_log"]+[can+"_logp" for can in cancers])
 	logps.columns = logp_labels  # overwrite labels
 	logps.iloc[:, 2:] = -np.log10(logps.iloc[:, 2:])
+	if "pnum" in pvs.columns:
+		logps["pnum"] = pnum
 
 	return logps
+
+
+def rank_file_pnum(rank_file):
+	"""
+	number of permutations of a rank file named by run_ptest.py (..._me_rank_$pstart_$pnum.txt)
+	:param rank_file: filename
+	:return: (pstart, pnum), None if the name does not follow the convention
+	"""
+	m = re.search(r"_me_rank_(\d+)_(\d+)\.txt$", rank_file)
+	if m is None:
+		return None
+	return int(m.group(1)), int(m.group(2))
+
+
+def merge_rank_files(rank_files, chunk_size=100000):
+	"""
+	sum rank files of the same edges (e.g., shards of run_ptest.py) chunk by chunk
+	edges (gene1, gene2) and columns must be identical and in the same order in all files
+	(ValueError is raised as soon as a chunk differs or a file ends before the others)
+
+	:param rank_files: list of rank filenames
+	:param chunk_size: number of edges read at a time (bounds the memory)
+	:return: generator of merged rank data frames (chunks in the order of edges)
+	"""
+	readers = [pandas.read_csv(f, sep="\t", chunksize=chunk_size, dtype={"gene1": str, "gene2": str},
+								keep_default_na=False) for f in rank_files]
+	for chunks in itertools.zip_longest(*readers):
+		for (rank_file, chunk) in zip(rank_files, chunks):
+			if chunk is None:
+				raise ValueError("%s has a different number of edges" % rank_file)
+		merged = chunks[0].copy()
+		rank_cols = list(merged.columns[2:])
+		for (rank_file, chunk) in zip(rank_files[1:], chunks[1:]):
+			if list(chunk.columns) != list(merged.columns):
+				raise ValueError("%s has different columns from %s" % (rank_file, rank_files[0]))
+			if len(chunk) != len(merged) or (chunk["gene1"].values != merged["gene1"].values).any() \
+					or (chunk["gene2"].values != merged["gene2"].values).any():
+				raise ValueError("%s has different edges from %s" % (rank_file, rank_files[0]))
+			merged[rank_cols] = merged[rank_cols] + chunk[rank_cols]
+		yield merged
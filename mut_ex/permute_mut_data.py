@@ -2,11 +2,15 @@
 # for permuting a mutation profile
 
 import random
+import multiprocessing
 import networkx as nx
+import numpy as np
 import logging
 # logging.basicConfig(level=logging.DEBUG)
 
+import utils.io as io
 import utils.misc as misc
+from utils.mut_matrix import MutMatrix, pack_rows
 
 
 def bipartite_double_edge_swap(G, genes, samples, nswap=1, max_tries=1e75):
@@ -71,6 +75,72 @@ def bipartite_double_edge_swap(G, genes, samples, nswap=1, max_tries=1e75):
 	return G
 
 
+def bipartite_double_edge_swap_arrays(edge_genes, edge_samples, nswap=1, max_tries=1e75, rng=None):
+	"""bipartite double edge swap on flat edge arrays (same null model as bipartite_double_edge_swap)
+	each round pairs up edges at random, (g1, s1), (g2, s2) -> (g1, s2), (g2, s1),
+	and performs all swaps of the round that create no parallel edges at once.
+	parallel edges are checked on a boolean adjacency matrix
+
+	:param edge_genes: int array, gene of each edge
+	:param edge_samples: int array, sample of each edge
+	:param nswap: int, number of double edge swap to perform
+	:param max_tries: int, maximum number of attempts to swap edges
+	:param rng: seed or np.random.Generator
+	:return: (edge_genes, edge_samples) permuted edge arrays (new arrays, same degrees)
+	"""
+	if nswap > max_tries:
+		raise nx.NetworkXError("Number of swaps > number of tries allowed.")
+	if len(edge_genes) < 2:
+		raise nx.NetworkXError("Graph has less than two edges.")
+	rng = np.random.default_rng(rng)
+
+	# relabel genes and samples to 0..n-1
+	(gkeys, g) = np.unique(edge_genes, return_inverse=True)
+	(pkeys, p) = np.unique(edge_samples, return_inverse=True)
+	adj = np.zeros((len(gkeys), len(pkeys)), dtype=bool)
+	adj[g, p] = True
+	# owner[x, y]: the swap (in the current round) allowed to create edge (x, y), -1 if none
+	owner = np.full(adj.shape, -1, dtype=np.int32)
+
+	nedges = len(g)
+	npairs = nedges // 2
+	n = 0
+	swapcount = 0
+	while swapcount < nswap:
+		# pick pairs of distinct edges
+		perm = rng.permutation(nedges)[:2*npairs]
+		e1, e2 = perm[0::2], perm[1::2]
+		g1, p1, g2, p2 = g[e1], p[e1], g[e2], p[e2]
+
+		# don't create parallel edges (also excludes g1 == g2 and p1 == p2)
+		cands = np.flatnonzero(~adj[g1, p2] & ~adj[g2, p1])
+		# two swaps in the same round must not create the same edge:
+		# each new edge is claimed by one swap, keep swaps owning both of their new edges
+		owner[g1[cands], p2[cands]] = cands
+		owner[g2[cands], p1[cands]] = cands
+		ok = (owner[g1[cands], p2[cands]] == cands) & (owner[g2[cands], p1[cands]] == cands)
+		owner[g1[cands], p2[cands]] = -1
+		owner[g2[cands], p1[cands]] = -1
+		swaps = cands[ok][:nswap - swapcount]
+
+		e1, e2, g1, p1, g2, p2 = e1[swaps], e2[swaps], g1[swaps], p1[swaps], g2[swaps], p2[swaps]
+		adj[g1, p1] = False
+		adj[g2, p2] = False
+		adj[g1, p2] = True
+		adj[g2, p1] = True
+		p[e1] = p2
+		p[e2] = p1
+		swapcount += len(swaps)
+
+		n += npairs
+		if n >= max_tries and swapcount < nswap:
+			e=('Maximum number of swap attempts (%s) exceeded '%n +
+			'before desired swaps achieved (%s).'%nswap)
+			raise nx.NetworkXAlgorithmError(e)
+		logging.debug("%d swaps..\n" %swapcount)
+	return gkeys[g], pkeys[p]
+
+
 def permute_mut_graph(G, genes, samples, Q=100):
 	"""Permutes a given mutation profile B(G, S) by performing |E| * Q edge swaps.
 
@@ -88,6 +158,141 @@ def permute_mut_graph(G, genes, samples, Q=100):
 	return H
 
 
+def permute_edge_arrays(edge_genes, edge_samples, Q=100, rng=None):
+	"""Permutes a mutation profile B(G, S) given as flat edge arrays by performing |E| * Q edge swaps.
+
+	:param edge_genes: int array, gene index of each edge
+	:param edge_samples: int array, sample index of each edge
+	:param Q: constant multiplier for number Q * | E | of edge swaps to perform (see permute_mut_graph)
+	:param rng: seed or np.random.Generator
+
+	:returns: (edge_genes, edge_samples) permuted edge arrays
+	"""
+	return bipartite_double_edge_swap_arrays(edge_genes, edge_samples, nswap=Q * len(edge_genes), rng=rng)
+
+
+def permutation_rng(seed, fid, cancer_id):
+	""" random generator for permuting the cancer_id-th type of the fid-th permutation instance
+	depends only on (seed, fid, cancer_id) so that an instance is the same
+	regardless of how permutation ids are split among runs
+
+	:param seed: base random seed (non-negative int)
+	:param fid: permutation file id
+	:param cancer_id: index of the cancer type
+	:return: np.random.Generator
+	"""
+	return np.random.default_rng([seed, fid, cancer_id])
+
+
+def permute_mut_instance(edge_arrays, cancers, genes, samples, fid, Q=100, seed=0):
+	"""Create the fid-th permutation instance from the edge arrays of the original profile
+	(the edge arrays are used as a template and not modified)
+
+	:param edge_arrays: cancer type -> (gene indices, sample indices) (see construct_edge_arrays_per_type)
+	:param cancers: cancer subtypes
+	:param genes: list of genes
+	:param samples: list of samples
+	:param fid: permutation file id
+	:param Q: constant multiplier for number Q * | E | of edge swaps (see permute_mut_graph)
+	:param seed: base random seed
+
+	:returns: MutMatrix permuted profile
+	"""
+	permuted_edge_arrays = {}
+	for i in range(len(cancers)):
+		(edge_genes, edge_samples) = edge_arrays[cancers[i]]
+		rng = permutation_rng(seed, fid, i)
+		permuted_edge_arrays[cancers[i]] = permute_edge_arrays(edge_genes, edge_samples, Q, rng)
+	return construct_mut_matrix_from_edges(permuted_edge_arrays, genes, samples)
+
+
+# original profile shared by the worker processes (see permute_mut_instances_parallel)
+_worker_template = {}
+
+
+def _init_worker(edge_arrays, cancers, genes, samples, Q, seed):
+	_worker_template.update(edge_arrays=edge_arrays, cancers=cancers, genes=genes, samples=samples, Q=Q, seed=seed)
+
+
+def _permute_instance_task(task):
+	""" create the fid-th instance (task = (fid, output_file)) and write it in output_file
+	return (fid, None), or (fid, MutMatrix) if output_file is None
+	"""
+	(fid, output_file) = task
+	t = _worker_template
+	permuted_mut_matrix = permute_mut_instance(t["edge_arrays"], t["cancers"], t["genes"], t["samples"],
+												fid, t["Q"], t["seed"])
+	if output_file is None:
+		return fid, permuted_mut_matrix
+	io.write_mut_list(permuted_mut_matrix, output_file)
+	return fid, None
+
+
+def _permute_type_task(task):
+	""" permute the cancer_id-th type of the fid-th instance (task = (fid, cancer_id))
+	return (fid, cancer_id, permuted edge arrays)
+	"""
+	(fid, cancer_id) = task
+	t = _worker_template
+	(edge_genes, edge_samples) = t["edge_arrays"][t["cancers"][cancer_id]]
+	rng = permutation_rng(t["seed"], fid, cancer_id)
+	return fid, cancer_id, permute_edge_arrays(edge_genes, edge_samples, t["Q"], rng)
+
+
+def permute_mut_instances_parallel(edge_arrays, cancers, genes, samples, fids, output_prefix, Q=100, seed=0, workers=1,
+									archive=None):
+	"""Create permutation instances with a process pool and write each in output_prefix+fid.txt
+	each worker creates a whole instance (all cancer types, seeded as in permute_mut_instance,
+	so the instances are the same as created one by one) and writes its file;
+	the next id is given to a worker as soon as it is done.
+	with archive, the instances are sent back and appended by this process in the order of fids
+	if there are fewer ids than workers, (fid, cancer type) pairs are permuted in parallel instead
+	and each instance is built and written by this process once all its types are done
+
+	:param edge_arrays: cancer type -> (gene indices, sample indices) (see construct_edge_arrays_per_type)
+	:param cancers: cancer subtypes
+	:param genes: list of genes
+	:param samples: list of samples
+	:param fids: list of permutation file ids
+	:param output_prefix: output file prefix
+	:param Q: constant multiplier for number Q * | E | of edge swaps (see permute_mut_graph)
+	:param seed: base random seed
+	:param workers: number of worker processes
+	:param archive: (optional) PermArchiveWriter to write the instances to, instead of text files
+	"""
+	fids = list(fids)
+	if archive is None:
+		tasks = [(fid, output_prefix+str(fid)+".txt") for fid in fids]
+	else:
+		tasks = [(fid, None) for fid in fids]
+	with multiprocessing.Pool(workers, _init_worker, (edge_arrays, cancers, genes, samples, Q, seed)) as pool:
+		if len(fids) < workers:
+			# too few instances to keep all workers busy (e.g., a single id)
+			permuted = dict([(fid, {}) for fid in fids])
+			pos = 0
+			type_tasks = [(fid, i) for fid in fids for i in range(len(cancers))]
+			for (fid, cancer_id, arrays) in pool.imap_unordered(_permute_type_task, type_tasks, chunksize=1):
+				permuted[fid][cancers[cancer_id]] = arrays
+				# instances done so far (in the order of fids)
+				while pos < len(fids) and len(permuted[fids[pos]]) == len(cancers):
+					permuted_mut_matrix = construct_mut_matrix_from_edges(permuted.pop(fids[pos]), genes, samples)
+					if archive is None:
+						io.write_mut_list(permuted_mut_matrix, tasks[pos][1])
+					else:
+						archive.append(fids[pos], permuted_mut_matrix)
+					logging.info("%d-th permutation is done\n" % fids[pos])
+					pos += 1
+			return
+		if archive is None:
+			results = pool.imap_unordered(_permute_instance_task, tasks, chunksize=1)
+		else:
+			results = pool.imap(_permute_instance_task, tasks, chunksize=1)
+		for (fid, permuted_mut_matrix) in results:
+			if archive is not None:
+				archive.append(fid, permuted_mut_matrix)
+			logging.info("%d-th permutation is done\n" % fid)
+
+
 def construct_mut_graph_per_type(mut_dic, cancers, type_idx_dic):
 	""" given mutation profile between genes and samples,
 	create a bipartite graph for each cancer type separately
@@ -131,3 +336,35 @@ def construct_mut_dic_from_graphs(graphs, genes, nsamples):
 				mut_dic[gene][i] = 1
 	return mut_dic
 
+
+def construct_edge_arrays_per_type(mut_matrix, cancers, type_idx_dic):
+	""" given mutation profile between genes and samples,
+	create flat edge arrays of the bipartite graph for each cancer type separately
+
+	:param mut_matrix: MutMatrix
+	:param cancers: cancer subtypes
+	:param type_idx_dic: dict cancer -> sample indices
+	:return edge_arrays: dict cancer -> (gene indices, sample indices) of alteration edges
+	"""
+	rows = mut_matrix.to_bool()
+	edge_arrays = {}
+	for cancer in cancers:
+		idxs = np.asarray(list(type_idx_dic[cancer]), dtype=np.int64)
+		(gene_idxs, local_idxs) = np.nonzero(rows[:, idxs])
+		edge_arrays[cancer] = (gene_idxs, idxs[local_idxs])
+	return edge_arrays
+
+
+def construct_mut_matrix_from_edges(edge_arrays, genes, samples):
+	"""  construct MutMatrix from permuted edge arrays for all types
+
+	:param edge_arrays: cancer type -> (gene indices, sample indices)
+	:param genes: list of genes
+	:param samples: list of samples
+	:return MutMatrix: altered or not for each sample (in the order as in samples)
+	"""
+	rows = np.zeros((len(genes), len(samples)), dtype=bool)
+	for cancer in edge_arrays:
+		(gene_idxs, sample_idxs) = edge_arrays[cancer]
+		rows[gene_idxs, sample_idxs] = True
+	return MutMatrix(genes, samples, pack_rows(rows))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+########################################################################
+# convert permutation files (text) into a binary permutation archive
+#
+# python pack_permute_cover.py pstart pnum ptype -mut mut_file -z (optional)
+#
+# e.g., to pack "tr_permuted_cover_0.txt" ... "tr_permuted_cover_9999.txt"
+#   into "tr_permuted_cover_0_10000.bin" (in config.permute_dir)
+#
+# >> python pack_permute_cover.py 0 10000 tr -mut=mut_data.txt
+#
+# the instances are aligned to the genes in the mutation file
+# use -z to compress the archive (instances are then decompressed when read)
+# see run_ptest.py -ar to use the archive
+########################################################################
+
+import argparse
+import logging
+
+import config
+import utils.io as io
+import utils.perm_archive as perm_archive
+
+# read arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("pstart", help="starting file id", type=int)
+parser.add_argument("pnum", help="number of files", type=int)
+parser.add_argument("ptype", help="permutation type (tr or to)", type=str)
+parser.add_argument("-mut", "--mut_file", help="mutation file name", type=str)
+parser.add_argument("-z", "--compress", help="compress the archive", action='store_true')
+
+args = parser.parse_args()
+pstart, pnum = args.pstart, args.pnum
+
+# INPUT_FILES
+if args.mut_file is None:
+	mut_file = config.mut_file # use default
+else:
+	mut_file = config.data_dir + args.mut_file
+pfile_prefix = config.permute_dir+args.ptype+"_permuted_cover_"
+
+# OUTPUT_FILES
+archive_file = pfile_prefix+str(pstart)+"_"+str(pnum)+".bin"
+
+# genes and samples of the original profile
+mut_matrix = io.read_mut_bits(mut_file)
+
+logging.info("packing permutation files %d-%d into %s\n" % (pstart, pstart+pnum-1, archive_file))
+fids = perm_archive.convert_mut_lists(pfile_prefix, range(pstart, pstart+pnum), archive_file,
+	mut_matrix.genes, mut_matrix.samples, args.compress)
+if len(fids) < pnum:
+	logging.warning("%d permutation files are missing" % (pnum - len(fids)))
@@ -7,6 +7,7 @@ import argparse
 import networkx as nx
 import pandas
 import importlib
+import numpy as np
 
 from config import *
 import module_cover.module_cover2 as module_cover2
@@ -34,11 +35,12 @@ overlapped_module_file = "results/overlapped_modules.txt"
 ### read edge scores
 sys.stdout.write("... read graph and edge weight....\n")
 G = io.read_net(hn_file, 100)
-(score_dics, slabels) = io.read_edge_attrs(scoresfile) ## edge scores from human net
-score_dic = score_dics[slabels.index(weight_type)]
+## edge scores from human net (float64 as in the weights of module_cover2)
+(score_graphs, slabels) = io.read_score_graphs(scoresfile, np.float64)
+score_dic = score_graphs[slabels.index(weight_type)]
 
 # read modules
-wdic = {}
+wdic = module_cover2.WeightMatrix([score_dic], [1])  ## weights between genes (score_dic * 1)
 (ogM, M_dic) = io.read_module_file(module_file)
 
 sys.stdout.write("merging modules ....\n")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+########################################################################
+# compute analytic p-values of mutual exclusivity for given pairs in efile
+# (fast alternative to run_permute_cover.py + run_ptest.py, no permutation needed)
+#
+# python run_analytic_test.py ptype -ef efile
+#
+# e.g., to compute p-values for all gene pairs given in human_net.net
+#  within each cancer type (tr)
+#
+# >> python run_analytic_test.py tr -ef human_net.net
+#
+# under the null, each gene is altered in each sample with a probability proportional
+# to the number of alterations of the gene and of the sample (within each cancer type for tr)
+# as the edge swaps of the permutations keep them; the p-value of a pair is the probability
+# that its overlap is not larger than observed (normal approximation with skewness correction)
+#
+# the results are stored as
+# $ptype_$efile(without extension)_me_analytic_pv.txt and ..._me_analytic_logp.txt
+# in config.me_dir directory in the same layout as the pv/logp files of run_ptest.py
+# e.g., the above command generates "tr_human_net_me_analytic_pv.txt"
+#
+# use -top option to test all pairs of the top most altered genes instead of the pairs in efile
+#
+# >> python run_analytic_test.py tr -top=1000
+#
+# edit INPUT/OUTPUT FILES as well as config.py file to change options.
+#
+########################################################################
+
+import argparse
+import logging
+import numpy as np
+
+from mut_ex import mut_ex
+from utils import io
+import config
+from config import cancers
+
+# read arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("ptype", help="permutation type (tr or to)", type=str)
+parser.add_argument("-ef", "--efile", help="edge list file name", type=str)
+parser.add_argument("-top", "--top_genes", help="test all pairs of the top most altered genes", type=int)
+
+args = parser.parse_args()
+
+if args.efile is None:
+    efile = config.hn_file  # use default
+else:
+    efile = config.data_dir + args.efile
+
+# filename prefix
+prefix = args.ptype + "_"
+logging.info("%s null model ..." % args.ptype)
+
+# INPUT FILES
+mut_file = config.mut_file
+efile_prefix = config.me_dir + prefix + efile.split("/")[-1].split(".")[0]+"_"  # pair results prefix
+if args.top_genes is not None:
+    efile_prefix = config.me_dir + prefix + "top" + str(args.top_genes) + "_"
+
+# OUTPUT FILES
+pvfile = efile_prefix+"me_analytic_pv.txt"
+logpfile = efile_prefix+"me_analytic_logp.txt"
+
+# original cover (packed bitsets)
+original_gene_dic = io.read_mut_bits(mut_file)
+samples = original_gene_dic.samples
+
+if args.top_genes is None:
+    # read graph
+    logging.info("reading %s... " % efile)
+    G = io.read_net(efile)
+    edges = list(G.edges())
+    (idx1, idx2) = mut_ex.edge_index(original_gene_dic, edges)
+else:
+    # all pairs of the top altered genes
+    top_rows = mut_ex.top_altered_genes(original_gene_dic, args.top_genes)
+    (idx1, idx2) = mut_ex.all_pair_index(top_rows)
+    edges = [(original_gene_dic.genes[x], original_gene_dic.genes[y]) for (x, y) in zip(idx1, idx2)]
+
+# for TR
+type_idx_dic, type_cancers = {}, []
+if args.ptype == "tr":
+    # construct dictionary each cancer type mapped to a set of sample indices
+    sample_type_dic = io.read_dic(config.subtype_file)
+    for cancer in cancers:
+        type_idx_dic[cancer] = list(filter(lambda i: sample_type_dic[samples[i]] == cancer, range(len(samples))))
+    type_cancers = cancers
+    # normalizing coefficients for each cancer type
+    coef_array = np.array([config.nsamples/float(len(type_idx_dic[can])) for can in cancers])
+else:
+    coef_array = None
+
+# samples of each cancer type are stored as a contiguous block of words
+(block_idxs, block_starts) = mut_ex.comp_type_blocks(type_idx_dic, type_cancers, len(samples))
+original_bits = mut_ex.segment_type_blocks(original_gene_dic, block_idxs)
+
+# p-values of all pairs at once
+logging.info("computing p-values for %d pairs... " % len(edges))
+pvs = mut_ex.comp_analytic_pv(original_bits, block_starts, idx1, idx2, original_gene_dic.present, coef_array)
+
+# Write the results
+all_pvs = mut_ex.pv_frame(edges, pvs, args.ptype, cancers)
+all_pvs.to_csv(pvfile, sep="\t", index=False)
+logps = mut_ex.comp_logp(all_pvs, args.ptype, cancers)
+logps.to_csv(logpfile, sep="\t", index=False)
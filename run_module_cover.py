@@ -25,6 +25,15 @@
 #                         node weight file name
 #   -out OUTPUT_PREFIX, --output_prefix OUTPUT_PREFIX
 #                        specify output filename prefix
+#   -init INIT_FILE, --init_file INIT_FILE
+#                         itr file of a previous run (in results directory) to start from
+#                         (the genes selected in the file are added at once, e.g., to extend
+#                         an interrupted run or to start k=20 from the result of k=15)
+#   -cp CHECKPOINT, --checkpoint CHECKPOINT
+#                         write the state in a checkpoint file every cp iterations
+#                         ("results/combined_itr_15_0.2.ckpt.npz")
+#   --resume              continue an interrupted run from the checkpoint
+#                         (the checkpoint is removed once the modules are written)
 #
 # See README file for input file formats.
 #
@@ -44,11 +53,13 @@
 
 # import packages
 import argparse
+import os
 import logging
 import networkx as nx
 
 import module_cover.module_cover as module_cover
 import utils.io as io
+from utils.score_graph import ScoreGraph
 import config
 
 # Read arguments
@@ -60,8 +71,13 @@ parser.add_argument("-net", "--net_file", help="network file name", type=str)
 parser.add_argument("-mw", "--mutw", help="mut weight relative to cnv", type=str)
 parser.add_argument("-nw", "--nw_file", help="node weight file name", type=str)
 parser.add_argument("-out", "--output_prefix", help="specify output filename prefix", type=str)
+parser.add_argument("-init", "--init_file", help="itr file of a previous run to start from", type=str)
+parser.add_argument("-cp", "--checkpoint", help="write a checkpoint every cp iterations", type=int)
+parser.add_argument("--resume", help="resume from the checkpoint", action='store_true')
 
 args = parser.parse_args()
+if args.checkpoint is not None and args.checkpoint <= 0:
+    parser.error("checkpoint interval (-cp) must be positive")
 
 # essential arguments
 k, ewth = args.k, args.ewth
@@ -94,35 +110,40 @@ else:
 
 # read mutation file
 logging.info("... read "+mut_file+"....\n")
-genes, samples, mut_dic = io.read_mut_matrix(mut_file, mutw, nw_file)
+mut_dic = io.read_mut_bits(mut_file, mutw, nw_file, weighted=True)
 
 # read network file
 logging.info("... read graph and edge weight....\n")
 G = nx.read_edgelist(net_file, nodetype=str, data=(('weight',float),))
-# create score dictionary
-temp_dic =nx.get_edge_attributes(G, 'weight')
-score_dic = {}
-for e in temp_dic:  # make sure to have entries for both direction
-    if e[0] not in score_dic:
-        score_dic[e[0]] = {}
-    score_dic[e[0]][e[1]] = temp_dic[e]
-    if e[1] not in score_dic:
-        score_dic[e[1]] = {}
-    score_dic[e[1]][e[0]] = temp_dic[e]
+# create sparse score graph (entries for both direction)
+score_dic = ScoreGraph.from_nx(G)
 
 
+# genes selected in a previous run (read before the itr file is overwritten)
+init = None
+if args.init_file is not None:
+    logging.info("... start from "+mod_dir+args.init_file+"....\n")
+    init_modules, init_mod_dic = io.read_module_file(mod_dir + args.init_file)
+    init = module_cover.selected_genes(init_mod_dic)
+
 # run module cover
 logging.info("... output will be stored in "+output+"....\n")
 # results in each iteration of module cover will be written in this file
 results_output=output + "_itr_"+str(k)+"_"+str(ewth)+".txt"
+# state of module cover is written in this file (with -cp) and read with --resume
+checkpoint_file = None
+if args.checkpoint is not None or args.resume:
+    checkpoint_file = output + "_itr_"+str(k)+"_"+str(ewth)+".ckpt.npz"
 
-M, total_cost = module_cover.greedy_module_cover(mut_dic, G, k, score_dic, ewth, results_output, True)
+M, total_cost = module_cover.greedy_module_cover(mut_dic, G, k, score_dic, ewth, results_output, True, init=init,
+                                                 checkpoint=checkpoint_file, cp=args.checkpoint, resume=args.resume)
 
 # write each module in a row
-module_file = open(output + "_modules_"+str(k)+"_"+str(ewth)+".txt", 'w')
-for i in range(len(M)):
-    module_file.write("%d\t%s\n" %(i, ",".join(M[i])))
+io.write_module_file(M, output + "_modules_"+str(k)+"_"+str(ewth)+".txt")
 
-module_file.close()
+# the checkpoint is not needed once the modules are written
+# (otherwise --resume would start from the finished state)
+if checkpoint_file is not None and os.path.isfile(checkpoint_file):
+    os.remove(checkpoint_file)
 
 
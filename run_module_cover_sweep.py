@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+########################################################################
+#
+# >> run_module_cover_sweep -k k1 k2 ... -ewth ewth1 ewth2 ...
+#
+# run module cover (see run_module_cover.py) for all combinations of k and ewth
+# the mutation profile and network are read once and the settings are run
+# in parallel by a process pool sharing them
+#
+# e.g.,
+# to run module cover with k=5, 10, 15 and edge weight threshold=0.1, 0.2 (6 settings) on 6 cores
+# >> python run_module_cover_sweep.py -k 5 10 15 -ewth 0.1 0.2 -mut=mut_data.txt -net=human_net.net -out=combined -w=6
+#
+# * arguments:
+#   -k K [K ...], --k K [K ...]
+#                         numbers of cover for each patient
+#   -ewth EWTH [EWTH ...], --ewth EWTH [EWTH ...]
+#                         edge weight thresholds
+#   -w WORKERS, --workers WORKERS
+#                         number of worker processes (default 1)
+#   -mut, -net, -mw, -nw, -out as in run_module_cover.py
+#
+# * results will be stored in
+#   "results/combined_itr_15_0.2.txt" and "results/combined_modules_15_0.2.txt"
+#   for each setting (same as run_module_cover.py), and
+#   "results/combined_sweep_summary.txt": number of modules, number of genes,
+#   total cost and running time (seconds) of each setting in a row
+#
+########################################################################
+
+# import packages
+import argparse
+import itertools
+import logging
+import networkx as nx
+
+import module_cover.module_cover as module_cover
+import utils.io as io
+from utils.score_graph import ScoreGraph
+import config
+
+# Read arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("-k", "--k", help="numbers of cover for each patient", type=int, nargs="+", required=True)
+parser.add_argument("-ewth", "--ewth", help="edge weight thresholds", type=float, nargs="+", required=True)
+parser.add_argument("-w", "--workers", help="number of worker processes", type=int, default=1)
+parser.add_argument("-mut", "--mut_file", help="mutation file name", type=str)
+parser.add_argument("-net", "--net_file", help="network file name", type=str)
+parser.add_argument("-mw", "--mutw", help="mut weight relative to cnv", type=str)
+parser.add_argument("-nw", "--nw_file", help="node weight file name", type=str)
+parser.add_argument("-out", "--output_prefix", help="specify output filename prefix", type=str)
+
+args = parser.parse_args()
+
+# all combinations of k and ewth
+settings = list(itertools.product(args.k, args.ewth))
+
+# optional arguments
+if args.mutw is None:
+    mutw = 1
+else:
+    mutw = args.mutw
+
+# INPUT FILES
+if args.mut_file is None:
+    mut_file = config.mut_file # use default
+else:
+    mut_file = config.data_dir + args.mut_file
+if args.net_file is None:
+    net_file = config.hn_file # use default
+else:
+    net_file = config.data_dir + args.net_file
+
+nw_file = args.nw_file
+
+# OUTPUT FILES
+mod_dir = "results/"
+logging.debug("... results will be stored in "+mod_dir+" directory....\n")
+if args.output_prefix is None:
+    output = mod_dir + "module_cover"
+else:
+    output = mod_dir + args.output_prefix
+summary_file = output + "_sweep_summary.txt"
+
+# read mutation file (once for all settings)
+logging.info("... read "+mut_file+"....\n")
+mut_dic = io.read_mut_bits(mut_file, mutw, nw_file, weighted=True)
+
+# read network file
+logging.info("... read graph and edge weight....\n")
+G = nx.read_edgelist(net_file, nodetype=str, data=(('weight',float),))
+# create sparse score graph (entries for both direction)
+score_dic = ScoreGraph.from_nx(G)
+
+
+# run module cover for all settings
+logging.info("... run %d settings with %d workers....\n" % (len(settings), args.workers))
+summary = module_cover.sweep_module_cover(mut_dic, G, score_dic, settings, output, True, args.workers)
+
+# write the summary of each setting in a row
+f = open(summary_file, 'w')
+f.write("k\tewth\tmodules\tgenes\ttotal_cost\tseconds\n")
+for (k, ewth, nmodules, ngenes, total_cost, seconds) in summary:
+    f.write("%d\t%s\t%d\t%d\t%f\t%.2f\n" % (k, str(ewth), nmodules, ngenes, total_cost, seconds))
+
+f.close()
@@ -3,7 +3,7 @@
 ########################################################################
 # permute the given mutation profile
 #
-# python run_permute_cover.py fid pnum ptype -mut mut_file
+# python run_permute_cover.py fid pnum ptype -mut mut_file -n nperm -s seed
 #
 # e.g.  to read "mut_data.txt" and run 100 * |E| edge swaps
 # 	to create a permuted mutational profile
@@ -16,6 +16,21 @@
 #   and create "to_permuted_cover_1.txt"
 # >> python run_permute_cover.py 1 100 to -mut=mut_data.txt
 #
+# use -n to create nperm instances (fid, ..., fid+nperm-1) in one run
+#   e.g., to create "tr_permuted_cover_0.txt" ... "tr_permuted_cover_99.txt"
+# >> python run_permute_cover.py 0 100 tr -mut=mut_data.txt -n=100
+#
+# each instance is determined by (seed, fid) (default seed 0)
+#   so the results are the same regardless of how the ids are split among runs
+#
+# use -w to run on multiple cores (instances are created and written in parallel;
+# the cancer types of each instance are permuted in parallel if -n is smaller than -w)
+# >> python run_permute_cover.py 0 100 tr -mut=mut_data.txt -n=10000 -w=64
+#
+# use -a to write all instances into one binary archive (-z to compress it)
+#   "tr_permuted_cover_0_10000.bin" instead of text files (see run_ptest.py -ar)
+# >> python run_permute_cover.py 0 100 tr -mut=mut_data.txt -n=10000 -w=64 -a
+#
 # modify INPUT/OUTPUT FILES as well as config.py file to change options.
 # see README.txt for input file format
 ########################################################################
@@ -24,9 +39,10 @@ import argparse
 import logging
 
 import config
-from config import cancers, nsamples
+from config import cancers
 from mut_ex import permute_mut_data
 import utils.io as io
+import utils.perm_archive as perm_archive
 
 # read arguments
 parser = argparse.ArgumentParser()
@@ -34,11 +50,16 @@ parser.add_argument("fid", help="permutation file id", type=int)
 parser.add_argument("pnum", help="number of edge swaps", type=int)
 parser.add_argument("ptype", help="permutation type (tr or to)", type=str)
 parser.add_argument("-mut", "--mut_file", help="mutation file name", type=str)
+parser.add_argument("-n", "--nperm", help="number of permutation instances (from fid)", type=int, default=1)
+parser.add_argument("-s", "--seed", help="random seed", type=int, default=0)
+parser.add_argument("-w", "--workers", help="number of worker processes (per instance, or per cancer type if n < w)", type=int, default=1)
+parser.add_argument("-a", "--archive", help="write a binary archive", action='store_true')
+parser.add_argument("-z", "--compress", help="compress the archive", action='store_true')
 
 args = parser.parse_args()
 fid, pnum = args.fid, args.pnum,
 
-logging.info("%d-th permutation.. (permute %d times)" % (fid, pnum))
+logging.info("%d-%d-th permutation.. (permute %d times)" % (fid, fid+args.nperm-1, pnum))
 
 
 if args.ptype == "to":
@@ -55,10 +76,12 @@ else:
 	mut_file = config.data_dir + args.mut_file
 
 # OUTPUT_FILES
-output_file = config.permute_dir+prefix+"permuted_cover_"+str(fid)+".txt"
+output_prefix = config.permute_dir+prefix+"permuted_cover_"
+archive_file = output_prefix+str(fid)+"_"+str(args.nperm)+".bin"
 
 # read data
-(genes, samples, mut_dic) = io.read_mut_matrix(mut_file)
+mut_matrix = io.read_mut_bits(mut_file)
+samples = mut_matrix.samples
 logging.info("\n****** reading data files...\n")
 
 # cancer types and permutation methods
@@ -73,19 +96,30 @@ elif args.ptype == "tr":  # for TR permutation
 	for cancer in cancers:
 		type_idx_dic[cancer] = list(filter(lambda i: sample_type_dic[samples[i]] == cancer, range(len(samples))))
 
-# construct a bipartite graph for each cancer type
-mut_graphs = permute_mut_data.construct_mut_graph_per_type(mut_dic, cancers, type_idx_dic)
+# construct a bipartite graph (flat edge arrays) for each cancer type
+edge_arrays = permute_mut_data.construct_edge_arrays_per_type(mut_matrix, cancers, type_idx_dic)
 
 # permute each bipartite graph separately
-logging.info("\n****** permuting the graph...\n")
-permuted_graphs = {}
-for cancer in cancers:
-	subG = mut_graphs[cancer]
-	permuted_graphs[cancer] = permute_mut_data.permute_mut_graph(subG, genes, type_idx_dic[cancer], pnum)
-
-# merge muted graphs and construct the permuted dic
-logging.info("construct mut_dic from permuted graphs\n")
-permuted_mut_dic = permute_mut_data.construct_mut_dic_from_graphs(permuted_graphs, genes, nsamples)
-
-# write the coverage of genes in permutation alteration in compact format (unweighted)
-io.write_mut_list(permuted_mut_dic, output_file)
+# the parsed profile and edge arrays are reused for all instances
+archive = None
+if args.archive:
+	archive = perm_archive.PermArchiveWriter(archive_file, mut_matrix.genes, len(samples), args.compress)
+
+if args.workers > 1:
+	logging.info("\n****** permuting the graph with %d workers...\n" % args.workers)
+	permute_mut_data.permute_mut_instances_parallel(edge_arrays, cancers, mut_matrix.genes, samples,
+		range(fid, fid+args.nperm), output_prefix, pnum, args.seed, args.workers, archive)
+else:
+	for i in range(fid, fid+args.nperm):
+		logging.info("\n****** permuting the graph (%d-th permutation)...\n" % i)
+		permuted_mut_matrix = permute_mut_data.permute_mut_instance(
+			edge_arrays, cancers, mut_matrix.genes, samples, i, pnum, args.seed)
+
+		if archive is not None:
+			archive.append(i, permuted_mut_matrix)
+		else:
+			# write the coverage of genes in permutation alteration in compact format (unweighted)
+			io.write_mut_list(permuted_mut_matrix, output_prefix+str(i)+".txt")
+
+if archive is not None:
+	archive.close()
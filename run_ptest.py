@@ -16,10 +16,45 @@
 # $ptype_$efile(without extension)_me_rank_$pstart_$pnum.txt
 # in config.permute_dir directory
 # e.g., the above command generates a file named "tr_human_net_me_rank_0_10.txt"
+# the last column "pnum" has the number of permutations counted for each edge
+# (less than pnum if some permutation files are missing)
 #
 # use --pv option to compute pvalues and logp files
 # (e.g., "tr_human_net_me_pv_0_10.txt" and "tr_human_net_me_logp_0_10.txt")
 #
+# use --stream option to create the permutation instances pstart..pstart+pnum-1
+# in memory (as run_permute_cover.py with the same -q, -s) instead of reading files
+# e.g., to run 100*|E| edge swaps for each of 10,000 TR instances and only write the ranks
+#
+# >> python run_ptest.py 0 10000 tr -ef human_net.net --stream -q=100
+#
+# use -ar option to read the instances pstart..pstart+pnum-1 from a permutation archive
+# (created by run_permute_cover.py -a or pack_permute_cover.py) in config.permute_dir
+#
+# >> python run_ptest.py 0 10000 tr -ef human_net.net -ar=tr_permuted_cover_0_10000.bin
+#
+# use -cp option to write the ranks every cp permutations in a checkpoint file
+# ($ptype_$efile(without extension)_me_rank_$pstart_$pnum.ckpt.npz) and --resume
+# to continue from the checkpoint (permutations already counted are skipped)
+#
+# >> python run_ptest.py 0 10000 tr -ef human_net.net --stream -cp=100 --resume
+#
+# use -ad option to stop testing an edge once all its ranks reach ad
+# (Besag-Clifford sequential test: its p-values are then about ad/(number of permutations),
+# so they are clearly not significant; edges with p-values < ad/pnum use all pnum permutations)
+# the number of permutations of each edge is in the "pnum" column of the rank file
+# (used as the denominator of the p-values)
+#
+# >> python run_ptest.py 0 10000 tr -ef human_net.net --stream -ad=10 --pv
+#
+# use -top option to test all pairs of the top most altered genes instead of the pairs in efile
+# e.g., to compute ranks for all pairs of the 1,000 most altered genes
+# (stored as "tr_top1000_me_rank_0_10000.txt")
+# the pairs are tested in tiles of the upper triangle (Gram matrices of gene blocks),
+# so only the ranks and the original cover sizes are kept for all pairs
+#
+# >> python run_ptest.py 0 10000 tr -top=1000 --stream
+#
 # edit INPUT/OUTPUT FILES as well as config.py file to change options.
 #
 ########################################################################
@@ -30,8 +65,8 @@ import pandas
 import logging
 import numpy as np
 
-from mut_ex import mut_ex
-from utils import io, misc
+from mut_ex import mut_ex, permute_mut_data
+from utils import io, perm_archive
 import config
 from config import cancers
 
@@ -42,9 +77,19 @@ parser.add_argument("pnum", help="number of files", type=int)
 parser.add_argument("ptype", help="permutation type (tr or to)", type=str)
 parser.add_argument("-ef", "--efile", help="edge list file name", type=str)
 parser.add_argument("--pv", help="compute pvalue?)", action='store_true')
+parser.add_argument("--stream", help="create permutation instances in memory", action='store_true')
+parser.add_argument("-q", "--nswap", help="number of edge swaps / |E| (with --stream)", type=int, default=100)
+parser.add_argument("-s", "--seed", help="random seed (with --stream)", type=int, default=0)
+parser.add_argument("-ar", "--archive", help="permutation archive file name", type=str)
+parser.add_argument("-cp", "--checkpoint", help="write a checkpoint every cp permutations", type=int)
+parser.add_argument("--resume", help="resume from the checkpoint", action='store_true')
+parser.add_argument("-ad", "--adaptive", help="stop testing an edge when its ranks reach ad", type=int)
+parser.add_argument("-top", "--top_genes", help="test all pairs of the top most altered genes", type=int)
 
 args = parser.parse_args()
 pstart, pnum = args.pstart, args.pnum
+if args.checkpoint is not None and args.checkpoint <= 0:
+    parser.error("checkpoint interval (-cp) must be positive")
 
 if args.efile is None:
     efile = config.hn_file  # use default
@@ -61,90 +106,213 @@ logging.info("%s permutation types ..." % args.ptype)
 mut_file = config.mut_file
 pfile_prefix = config.permute_dir+prefix+"permuted_cover_"  # permutation file prefix
 efile_prefix = config.me_dir + prefix + efile.split("/")[-1].split(".")[0]+"_"  # pair results prefix
+if args.top_genes is not None:
+    efile_prefix = config.me_dir + prefix + "top" + str(args.top_genes) + "_"
 
 # OUTPUT FILES
 rank_file = efile_prefix+"me_rank_"+str(pstart)+"_"+str(pnum)+".txt"
 pvfile = efile_prefix+"me_pv_"+str(pstart)+"_"+str(pnum)+".txt"
 logpfile = efile_prefix+"me_logp_"+str(pstart)+"_"+str(pnum)+".txt"
-
-# read graph
-logging.info("reading %s... " % efile)
-G = io.read_net(efile)
-edges = G.edges()
+checkpoint_file = efile_prefix+"me_rank_"+str(pstart)+"_"+str(pnum)+".ckpt.npz"
 
 # original cover (written in matrix format)
-(genes, samples, rel_dic) = io.read_mut_matrix(mut_file)
-# gene -> covered sample indices
-original_gene_dic = dict([(x, misc.get_positives(rel_dic[x])) for x in rel_dic])
-cover_size_list = mut_ex.comp_pair_cover(original_gene_dic, edges)
-# ranks of original cover
-rank_list = [0 for i in range(len(edges))]
-norm_rank_list = [0 for i in range(len(edges))]
+# gene -> covered samples (packed bitsets)
+original_gene_dic = io.read_mut_bits(mut_file)
+samples = original_gene_dic.samples
+
+if args.top_genes is None:
+    # read graph
+    logging.info("reading %s... " % efile)
+    G = io.read_net(efile)
+    edges = list(G.edges())
+    # row indices of the two genes in each pair
+    (idx1, idx2) = mut_ex.edge_index(original_gene_dic, edges)
+else:
+    # all pairs of the top altered genes, tested tile by tile
+    # (pairs are kept as row indices, gene names are used only when written)
+    top_rows = mut_ex.top_altered_genes(original_gene_dic, args.top_genes)
+    (idx1, idx2) = mut_ex.all_pair_index(top_rows)
+    tiles = list(mut_ex.all_pair_tiles(len(top_rows)))
+    logging.info("testing %d pairs of %d genes... " % (len(idx1), len(top_rows)))
+nedges = len(idx1)
 
 # for TR
+type_idx_dic, type_cancers = {}, []
 if args.ptype == "tr":
     # construct dictionary each cancer type mapped to a set of sample indices
     sample_type_dic = io.read_dic(config.subtype_file)
-    type_idx_dic = {}
     for cancer in cancers:
         type_idx_dic[cancer] = list(filter(lambda i: sample_type_dic[samples[i]] == cancer, range(len(samples))))
+    type_cancers = cancers
+    # normalizing coefficients for each cancer type
     type_coefs = dict([(cancer, config.nsamples/float(len(type_idx_dic[cancer]))) for cancer in cancers])
     logging.debug("cancer type normalizing coefficients: %s\n" % str(type_coefs))
-    # cancer type -> gene ->  covered sample indices
-    original_gene_dic_per_type = mut_ex.comp_type_dic(original_gene_dic, type_idx_dic)
-    # normalizing coefficients for each cancer type
-    cover_size_list_per_type = {}
-    for cancer in cancers:
-        cover_size_list_per_type[cancer] = \
-            mut_ex.comp_pair_cover(original_gene_dic_per_type[cancer], edges)
-    norm_cover_size_list = mut_ex.norm_cover_size(cover_size_list_per_type, type_coefs)
-    # ranks for each type
-    rank_list_per_type = {}
-    for can in cancers:
-        rank_list_per_type[can] = [0 for i in range(len(edges))]
-
-# process each permutation file
-for i in range(pstart, pstart+pnum):
-    # read a permuted instance
-    pfile = pfile_prefix+str(i)+".txt"
-    if not os.path.isfile(pfile):
-        logging.warning("%s doesn't exist" % pfile)
-        continue
-    logging.debug("reading %d-th permutation file", i)
-    permuted_gene_dic = io.read_mut_list(pfile)
-    # compute the cover sizes for given edges
-    permuted_cover_size_list = mut_ex.comp_pair_cover(permuted_gene_dic, edges)
-    # update rank each time to avoid store all permuted mutation instances
-    rank_list = mut_ex.update_rank(rank_list, cover_size_list, permuted_cover_size_list)
-    # for each type ONLY FOR tr/ts
+    coef_array = np.array([type_coefs[can] for can in cancers])
+else:
+    coef_array = None
+
+# samples of each cancer type are stored as a contiguous block of words
+# (for TO, all samples are in a single block)
+(block_idxs, block_starts) = mut_ex.comp_type_blocks(type_idx_dic, type_cancers, len(samples))
+
+
+def comp_block_cover(bits, present, active=None):
+    """ cover sizes per type (edges x blocks) of all edges (or the edges in active)
+    """
+    if active is None:
+        return mut_ex.batch_type_cover(bits, block_starts, idx1, idx2, present)
+    return mut_ex.batch_type_cover(bits, block_starts, idx1[active], idx2[active], present)
+
+
+# cover sizes per type (edges x blocks) of original cover
+# raw, normalized (TR) and per type (TR) cover sizes are derived from them
+original_bits = mut_ex.segment_type_blocks(original_gene_dic, block_idxs)
+if args.top_genes is None:
+    block_cover_sizes = comp_block_cover(original_bits, original_gene_dic.present)
+    cover_sizes = mut_ex.comp_cover_columns(block_cover_sizes, coef_array)
+    permuted_cover_sizes = np.empty(cover_sizes.shape)
+else:
+    # all pairs: cover sizes per type are kept in the smallest integer type,
+    # and the columns are derived for each tile when ranks are updated
+    (vectors, degrees) = mut_ex.all_pair_vectors(original_bits, block_starts, top_rows)
+    original_block_cover_sizes = np.zeros((nedges, len(block_starts)-1), dtype=np.min_scalar_type(len(samples)))
+    for tile in tiles:
+        (pos, ii, jj) = mut_ex.tile_pair_index(len(top_rows), tile)
+        original_block_cover_sizes[pos] = mut_ex.all_pair_cover(vectors, degrees, tile, ii, jj,
+                                                                original_gene_dic.present[top_rows])
+    cover_sizes = None
+# ranks of original cover (raw, norm and each type)
+ranks = mut_ex.RankAccumulator(cover_sizes, mut_ex.rank_labels(args.ptype, cancers), nedges=nedges)
+if args.resume and os.path.isfile(checkpoint_file):
+    ranks = mut_ex.RankAccumulator.load(checkpoint_file, cover_sizes)
+    if ranks.labels != mut_ex.rank_labels(args.ptype, cancers) or len(ranks.ranks) != nedges:
+        raise ValueError("%s has different edges or rank columns" % checkpoint_file)
+    logging.info("resume from %s (%d permutations)" % (checkpoint_file, ranks.pnum))
+
+# permuted instances are created in memory (--stream) or read from files
+if args.stream:
     if args.ptype == "tr":
-        # TS ranks
-        permuted_gene_dic_per_type = mut_ex.comp_type_dic(permuted_gene_dic, type_idx_dic)
-        permuted_cover_size_list_per_type = {}
-        for can in cancers:
-            permuted_cover_size_list_per_type[can] = mut_ex.comp_pair_cover(permuted_gene_dic_per_type[can], edges)
-            rank_list_per_type[can] = mut_ex.update_rank(
-                rank_list_per_type[can], cover_size_list_per_type[can], permuted_cover_size_list_per_type[can])
-        # normalized TR ranks
-        norm_permuted_cover_size_list = mut_ex.norm_cover_size(permuted_cover_size_list_per_type, type_coefs)
-        norm_rank_list = mut_ex.update_rank(norm_rank_list, norm_cover_size_list, norm_permuted_cover_size_list)
-
-
-# create ME data
-rank_labels = ["gene1", "gene2", "raw_me_rank"]
-d = zip(*edges) + [rank_list]
-if args.ptype == "tr":
-    rank_labels += ["norm_me_rank"]
-    d += [norm_rank_list]
-    rank_labels += [can+"_me_rank" for can in cancers]
-    d += [rank_list_per_type[can] for can in cancers]
-
-# Write the results
-all_ranks = pandas.DataFrame(data=zip(*d), columns=rank_labels)
-all_ranks.to_csv(rank_file, sep="\t", index=False)
-
-if args.pv:
-    pvs = mut_ex.comp_pv(all_ranks, args.ptype, pnum, cancers)
-    pvs.to_csv(pvfile, sep="\t", index=False)
-    logps = mut_ex.comp_logp(pvs, args.ptype, cancers)
-    logps.to_csv(logpfile, sep="\t", index=False)
+        perm_cancers, perm_type_idx_dic = cancers, type_idx_dic
+    else:
+        perm_cancers, perm_type_idx_dic = ["all"], dict([("all", range(len(samples)))])
+    edge_arrays = permute_mut_data.construct_edge_arrays_per_type(original_gene_dic, perm_cancers, perm_type_idx_dic)
+
+
+def permuted_instances(skip):
+    """ permuted instances pstart..pstart+pnum-1 not in skip
+    yield (id, MutMatrix aligned to the original genes)
+    """
+    if args.archive is not None:
+        archive = perm_archive.PermArchive(config.permute_dir + args.archive)
+        for k in range(len(archive)):
+            if pstart <= archive.fids[k] < pstart+pnum and archive.fids[k] not in skip:
+                logging.debug("reading %d-th permutation from the archive", archive.fids[k])
+                yield archive.fids[k], archive.get(k, original_gene_dic)
+        return
+    for i in range(pstart, pstart+pnum):
+        if i in skip:
+            continue
+        if args.stream:
+            logging.debug("creating %d-th permutation", i)
+            permuted_gene_dic = permute_mut_data.permute_mut_instance(
+                edge_arrays, perm_cancers, original_gene_dic.genes, samples, i, args.nswap, args.seed)
+            # as in permutation files (genes covering no sample are not written)
+            permuted_gene_dic.present = permuted_gene_dic.degrees() > 0
+            yield i, permuted_gene_dic
+        else:
+            # read a permuted instance
+            pfile = pfile_prefix+str(i)+".txt"
+            if not os.path.isfile(pfile):
+                logging.warning("%s doesn't exist" % pfile)
+                continue
+            logging.debug("reading %d-th permutation file", i)
+            yield i, io.read_mut_list_bits(pfile, samples, original_gene_dic.genes)
+
+
+def update_all_pair_ranks(bits, present):
+    """ update the ranks of all pairs of the top genes tile by tile
+    (in the adaptive test, only the pairs not stopped yet; tiles without them are skipped)
+    """
+    (vectors, degrees) = mut_ex.all_pair_vectors(bits, block_starts, top_rows)
+    for tile in tiles:
+        (pos, ii, jj) = mut_ex.tile_pair_index(len(top_rows), tile)
+        if args.adaptive is not None:
+            tested = active_mask[pos]
+            if not tested.any():
+                continue
+            (pos, ii, jj) = (pos[tested], ii[tested], jj[tested])
+        permuted_block_cover_sizes = mut_ex.all_pair_cover(vectors, degrees, tile, ii, jj, present[top_rows])
+        ranks.update_rows(mut_ex.comp_cover_columns(permuted_block_cover_sizes, coef_array), pos,
+                          mut_ex.comp_cover_columns(original_block_cover_sizes[pos], coef_array))
+        if args.adaptive is not None:
+            active_mask[pos] = ~ranks.stopped(args.adaptive, pos)
+
+
+def nactive():
+    """ number of edges still tested (adaptive test)
+    """
+    return len(active) if args.top_genes is None else np.count_nonzero(active_mask)
+
+
+# edges still tested (adaptive test)
+if args.adaptive is not None:
+    if args.top_genes is None:
+        active = np.flatnonzero(~ranks.stopped(args.adaptive))
+    else:
+        active_mask = ~ranks.stopped(args.adaptive)
+
+# process each permutation instance
+for (i, permuted_gene_dic) in permuted_instances(set(ranks.fids)):
+    permuted_bits = mut_ex.segment_type_blocks(permuted_gene_dic, block_idxs)
+    if args.top_genes is not None:
+        update_all_pair_ranks(permuted_bits, permuted_gene_dic.present)
+        ranks.count(i)
+    elif args.adaptive is None:
+        # compute the cover sizes (per type) for given edges in one pass
+        permuted_block_cover_sizes = comp_block_cover(permuted_bits, permuted_gene_dic.present)
+        mut_ex.comp_cover_columns(permuted_block_cover_sizes, coef_array, permuted_cover_sizes)
+        # update rank each time to avoid store all permuted mutation instances
+        ranks.update(permuted_cover_sizes, i)
+    else:
+        # only for the edges not stopped yet
+        permuted_block_cover_sizes = comp_block_cover(permuted_bits, permuted_gene_dic.present, active)
+        ranks.update(mut_ex.comp_cover_columns(permuted_block_cover_sizes, coef_array), i, active)
+        active = active[~ranks.stopped(args.adaptive, active)]
+    if args.checkpoint is not None and ranks.pnum % args.checkpoint == 0:
+        logging.info("writing checkpoint (%d permutations)" % ranks.pnum)
+        ranks.save(checkpoint_file)
+    if args.adaptive is not None and nactive() == 0:
+        logging.info("all edges stopped after %d permutations" % ranks.pnum)
+        break
+
+
+def edge_names(start, end):
+    """ gene pairs of the edges start..end-1
+    """
+    if args.top_genes is None:
+        return edges[start:end]
+    genes = original_gene_dic.genes
+    return [(genes[x], genes[y]) for (x, y) in zip(idx1[start:end], idx2[start:end])]
+
+
+# Write the results (in chunks of edges)
+# p-values from the permutations actually counted (missing files are skipped);
+# the counts are written in the "pnum" column, so merge_ranks.py sums the actual numbers
+if args.pv and ranks.pnum < pnum and (args.adaptive is None or nactive() > 0):
+    logging.warning("only %d of %d permutations are counted" % (ranks.pnum, pnum))
+chunk_size = 100000
+for start in range(0, max(nedges, 1), chunk_size):
+    (mode, header) = ('w', True) if start == 0 else ('a', False)
+    end = min(start + chunk_size, nedges)
+    all_ranks = ranks.to_frame(edge_names(start, end), counts=True, rows=slice(start, end))
+    all_ranks.to_csv(rank_file, sep="\t", index=False, mode=mode, header=header)
+    if args.pv:
+        pvs = mut_ex.comp_pv(all_ranks, args.ptype, ranks.pnum, cancers)
+        pvs.to_csv(pvfile, sep="\t", index=False, mode=mode, header=header)
+        logps = mut_ex.comp_logp(pvs, args.ptype, cancers)
+        logps.to_csv(logpfile, sep="\t", index=False, mode=mode, header=header)
+
+# the checkpoint is not needed once the results are written
+# (otherwise --resume would start from the finished ranks)
+if os.path.isfile(checkpoint_file):
+    os.remove(checkpoint_file)
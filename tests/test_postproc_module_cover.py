@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# regression tests of postproc_module_cover.py
+
+"""
+merged and overlapped modules of postproc_module_cover.py on a small random network
+compared with the outputs of the original implementation (weight dic and full scans)
+
+data/postproc: human_net.net, all_edge_score_norm_0.5_0.5.eda (data directory)
+	and norm_modules.txt (results of module cover)
+data/postproc/expected: merged_modules.txt and overlapped_modules.txt written by
+	the original implementation with PYTHONHASHSEED=0
+	(the fixture has pairs with the same module cost, so the tie-breaks are also compared)
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fixture_dir = os.path.join(repo_dir, "tests", "data", "postproc")
+
+
+@pytest.fixture(scope="module")
+def results_dir(tmp_path_factory):
+	""" run postproc_module_cover.py on the fixture in a temporary directory
+	"""
+	work_dir = tmp_path_factory.mktemp("postproc")
+	os.makedirs(os.path.join(work_dir, "data"))
+	os.makedirs(os.path.join(work_dir, "results"))
+	for f in ["human_net.net", "all_edge_score_norm_0.5_0.5.eda"]:
+		shutil.copy(os.path.join(fixture_dir, f), os.path.join(work_dir, "data", f))
+	shutil.copy(os.path.join(fixture_dir, "norm_modules.txt"), os.path.join(work_dir, "results"))
+	## the original implementation iterates over sets of genes
+	env = dict(os.environ, PYTHONHASHSEED="0")
+	subprocess.run([sys.executable, os.path.join(repo_dir, "postproc_module_cover.py")], cwd=work_dir, env=env,
+					check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	return os.path.join(work_dir, "results")
+
+
+def read_lines(filename):
+	with open(filename) as f:
+		return f.read().splitlines()
+
+
+def test_merged_modules(results_dir):
+	expected = read_lines(os.path.join(fixture_dir, "expected", "merged_modules.txt"))
+	assert read_lines(os.path.join(results_dir, "merged_modules.txt")) == expected
+
+
+def test_overlapped_modules(results_dir):
+	expected = read_lines(os.path.join(fixture_dir, "expected", "overlapped_modules.txt"))
+	assert read_lines(os.path.join(results_dir, "overlapped_modules.txt")) == expected
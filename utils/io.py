@@ -10,6 +10,8 @@ import numpy as np
 import pandas
 
 import utils.misc as misc
+from utils.mut_matrix import MutMatrix, pack_rows
+from utils.score_graph import ScoreGraph
 
 
 def read_net(netfile, top="NA"):
@@ -156,6 +158,53 @@ def read_mut_matrix(filename, mw=3, mutsig_file=None):
 	return genes, samples, data_dic
 
 
+def read_mut_bits(filename, mw=3, mutsig_file=None, weighted=False):
+	""" read a bipartite graph B(G, S) in the labeled matrix format (see read_mut_matrix)
+	into a MutMatrix (packed bitset per gene) without building per-gene lists
+
+	:param filename
+	:param mw (the relative weight of somatic mutation) default=3
+	:param mutsig_file: gene weight file from mutsig (see read_mut_matrix)
+	:param weighted: keep edge weights e(g, s) as a float32 array (needed for module cover)
+	:return MutMatrix
+	"""
+	weight_dic = dict([('N', 0), ('C', 1), ('M', float(mw)), ('B', float(mw)+1)])
+	if mutsig_file is not None:
+		mutsig = pandas.read_table(mutsig_file, sep=" ", index_col=0).to_dict()['mutsig_score']
+	f = open(filename)
+	samples = f.readline().split()[1:]
+	genes, bit_rows, weight_rows = [], [], []
+	for l in f:
+		tkns = l.split()
+		if len(tkns) == 0:
+			continue
+		row = np.array([weight_dic[x] for x in tkns[1:]], dtype=np.float32)
+		genes.append(tkns[0])
+		bit_rows.append(pack_rows(row > 0))
+		if weighted:
+			if mutsig_file is not None:
+				row *= (mutsig[tkns[0]]+1)
+			weight_rows.append(row)
+	f.close()
+
+	bits = np.vstack(bit_rows) if len(bit_rows) > 0 else np.zeros((0, (len(samples)+63)//64), dtype=np.uint64)
+	weights = np.vstack(weight_rows) if weighted and len(weight_rows) > 0 else None
+	return MutMatrix(genes, samples, bits, weights)
+
+
+def read_mut_list_bits(filename, samples, genes=None, sep=","):
+	""" read a bipartite graph B(G, S) in the compact list format (see read_mut_list)
+	into a MutMatrix
+
+	:param filename
+	:param samples: list of samples (or number of samples)
+	:param genes: (optional) gene order to align to (e.g., genes of the original MutMatrix)
+	:param sep default=","
+	:return MutMatrix
+	"""
+	return MutMatrix.from_list_dic(read_mut_list(filename, sep), samples, genes)
+
+
 def write_mut_matrix(genes, samples, data_dic, filename):
 	"""
 	write a bipartite graph B(G, S) in the form of a weighted matrix
@@ -188,15 +237,20 @@ def write_mut_list(rel_dic, filename, sep=","):
 	** USE THIS FORMAT FOR UNWEIGHTED CASES. COMPACT FORMAT
 	example:
 		PTEN	12,14,36,40
-	:param rel_dic: dict gene -> weights of edges in B(G, S), 0 for no edge
+	:param rel_dic: dict gene -> weights of edges in B(G, S), 0 for no edge (or MutMatrix)
 	:param filename
 	:param sep default=","
 	:return
 	"""
 
+	if isinstance(rel_dic, MutMatrix):
+		cover_dic = rel_dic.list_dic()
+	else:
+		cover_dic = dict([(g, list(misc.get_positives(rel_dic[g]))) for g in rel_dic])
+
 	list_dic = {}
-	for g in rel_dic:
-		covers = misc.get_positives(rel_dic[g])
+	for g in cover_dic:
+		covers = cover_dic[g]
 		if len(covers) == 0:
 			continue
 		list_dic[g] = sep.join([str(x) for x in covers])
@@ -263,6 +317,34 @@ def read_edge_attrs(filename):
 	return score_dics, labels
 
 
+def read_score_graphs(filename, dtype=np.float32):
+	""" read score file between two genes (see read_edge_attrs)
+	into sparse score graphs without building dicts
+	dtype: type of the scores (float32 by default, np.float64 for the same scores as read_edge_attrs)
+	Returns: tuple of ScoreGraphs (one for each label) and labels
+	"""
+	lines = open(filename).readlines()
+
+	if len(lines) == 0:  ## when the file is empty
+		return [], []
+
+	labels = lines[0].split()[1:]
+	(xs, ys, values) = ([], [], [])
+	for l in lines[1:]:
+		tkns = l.split("\t")
+		(x, etype, y) = tkns[0].split()
+		xs.append(x)
+		ys.append(y)
+		values.append(tkns[1:len(labels)+1])
+	genes = list(dict.fromkeys(xs))  # genes with an entry in read_edge_attrs
+	score_graphs = []
+	for i in range(len(labels)):
+		given = [j for j in range(len(xs)) if values[j][i] != "NA"]
+		score_graphs.append(ScoreGraph.from_edges([xs[j] for j in given], [ys[j] for j in given],
+							[float(values[j][i]) for j in given], genes, dtype=dtype))
+	return score_graphs, labels
+
+
 def read_module_file(filename):
 	""" read module file generated by greedy_min_cost_module_cover
 	:
@@ -319,6 +401,18 @@ def read_simple_module_file(filename, nM_dic=None):
 	return modules, M_dic
 
 
+def write_module_file(M, filename):
+	""" write each module in a row (module id and comma separated genes)
+	as the modules file of run_module_cover.py
+	M: modules
+	filename
+	"""
+	f = open(filename, 'w')
+	for i in range(len(M)):
+		f.write("%d\t%s\n" % (i, ",".join(M[i])))
+	f.close()
+
+
 def write_genes_in_modules(M, filename):
 	""" write genes in each module in one line (comma separated)
 	M: modules
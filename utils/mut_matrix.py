@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# compact gene x sample mutation matrix (packed bitsets)
+
+import numpy as np
+
+# lookup table for counting bits when np.bitwise_count is not available
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_rows(bool_rows):
+	""" pack a boolean matrix into uint64 words (one bitset per row)
+	bit j of a row is set iff bool_rows[., j] is True
+
+	:param bool_rows: 2-d array-like of booleans (rows x samples)
+	:return: bits: rows x nwords uint64 array
+	"""
+	bool_rows = np.asarray(bool_rows, dtype=bool)
+	if bool_rows.ndim == 1:
+		bool_rows = bool_rows.reshape(1, -1)
+	nwords = (bool_rows.shape[1] + 63) // 64
+	packed = np.packbits(bool_rows, axis=1, bitorder="little")
+	padded = np.zeros((bool_rows.shape[0], nwords * 8), dtype=np.uint8)
+	padded[:, :packed.shape[1]] = packed
+	return padded.view(np.uint64)
+
+
+def unpack_rows(bits, nsamples):
+	""" inverse of pack_rows
+
+	:param bits: rows x nwords uint64 array
+	:param nsamples: number of samples (columns)
+	:return: rows x nsamples boolean array
+	"""
+	bits = np.ascontiguousarray(bits, dtype=np.uint64)
+	if bits.ndim == 1:
+		bits = bits.reshape(1, -1)
+	unpacked = np.unpackbits(bits.view(np.uint8), axis=1, count=nsamples, bitorder="little")
+	return unpacked.astype(bool)
+
+
+def popcount_words(words):
+	""" count set bits of each word
+
+	:param words: uint64 array (..., nwords)
+	:return: uint8 array of the same shape
+	"""
+	words = np.ascontiguousarray(words, dtype=np.uint64)
+	if hasattr(np, "bitwise_count"):
+		return np.bitwise_count(words)
+	counts = _POPCOUNT8[words.view(np.uint8)]
+	return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def popcount(words):
+	""" count set bits of packed bitsets (summed over the last axis)
+
+	:param words: uint64 array (..., nwords)
+	:return: int64 array of shape words.shape[:-1]
+	"""
+	words = np.ascontiguousarray(words, dtype=np.uint64)
+	if hasattr(np, "bitwise_count"):
+		return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+	return _POPCOUNT8[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def sample_mask(sample_idxs, nsamples):
+	""" bitset (1 x nwords) with the bits of the given sample indices set
+	"""
+	row = np.zeros(nsamples, dtype=bool)
+	row[list(sample_idxs)] = True
+	return pack_rows(row)
+
+
+class MutMatrix(object):
+	""" bipartite graph B(G, S) with the alteration profile of each gene
+	stored as a packed bitset (bit j of bits[i] is set iff genes[i] covers samples[j])
+
+	genes: list of genes, gene_idx: gene -> row index
+	samples: list of samples, sample_idx: sample -> column index
+	bits: ngenes x nwords uint64 array
+	weights: (optional) ngenes x nsamples float32 array, edge weights e(g, s)
+	present: boolean array, False for genes without an entry in the input
+		(e.g., genes dropped by write_mut_list); pairs with such a gene have cover 0
+	"""
+
+	def __init__(self, genes, samples, bits, weights=None, present=None):
+		self.genes = list(genes)
+		self.samples = list(samples)
+		self.gene_idx = dict([(g, i) for i, g in enumerate(self.genes)])
+		self.sample_idx = dict([(s, j) for j, s in enumerate(self.samples)])
+		self.bits = np.ascontiguousarray(bits, dtype=np.uint64).reshape(len(self.genes), -1)
+		self.weights = weights
+		if present is None:
+			present = np.ones(len(self.genes), dtype=bool)
+		self.present = np.asarray(present, dtype=bool)
+
+	@classmethod
+	def from_dic(cls, genes, samples, data_dic, keep_weights=False):
+		""" construct from the dict used by read_mut_matrix
+
+		:param genes: list of genes
+		:param samples: list of samples
+		:param data_dic: gene -> list of edge weights (> 0 iff altered)
+		:param keep_weights: keep edge weights as a float32 array
+		:return: MutMatrix
+		"""
+		weights = np.array([data_dic[g] for g in genes], dtype=np.float32).reshape(len(genes), len(samples))
+		bits = pack_rows(weights > 0)
+		if not keep_weights:
+			weights = None
+		return cls(genes, samples, bits, weights)
+
+	@classmethod
+	def from_list_dic(cls, list_dic, samples, genes=None):
+		""" construct from the dict used by read_mut_list
+
+		:param list_dic: gene -> list of covered sample indices
+		:param samples: list of samples (or number of samples)
+		:param genes: (optional) gene order to align to, e.g. genes of the original matrix
+				genes not in list_dic are kept as empty rows marked as not present
+		:return: MutMatrix
+		"""
+		if isinstance(samples, int):
+			samples = list(range(samples))
+		if genes is None:
+			genes = list(list_dic)
+		rows = np.zeros((len(genes), len(samples)), dtype=bool)
+		present = np.zeros(len(genes), dtype=bool)
+		for i, g in enumerate(genes):
+			if g in list_dic:
+				rows[i, list_dic[g]] = True
+				present[i] = True
+		return cls(genes, samples, pack_rows(rows), present=present)
+
+	@classmethod
+	def like(cls, template, bits, present=None):
+		""" construct a matrix with the genes and samples of template
+		sharing its lists and index dicts (nothing is rebuilt or copied)
+
+		:param template: MutMatrix
+		:param bits: ngenes x nwords uint64 array (rows in the order of template.genes)
+		:param present: (optional) boolean array
+		:return: MutMatrix
+		"""
+		mat = cls.__new__(cls)
+		mat.genes, mat.samples = template.genes, template.samples
+		mat.gene_idx, mat.sample_idx = template.gene_idx, template.sample_idx
+		mat.bits = bits
+		mat.weights = None
+		if present is None:
+			present = np.ones(len(template.genes), dtype=bool)
+		mat.present = present
+		return mat
+
+	@property
+	def ngenes(self):
+		return len(self.genes)
+
+	@property
+	def nsamples(self):
+		return len(self.samples)
+
+	@property
+	def nwords(self):
+		return self.bits.shape[1]
+
+	def __len__(self):
+		return len(self.genes)
+
+	def __iter__(self):
+		return iter(self.genes)
+
+	def __contains__(self, gene):
+		return gene in self.gene_idx and self.present[self.gene_idx[gene]]
+
+	def degrees(self):
+		""" number of altered samples for each gene (in the order of genes)
+		"""
+		return popcount(self.bits)
+
+	def positives(self, gene):
+		""" list of sample indices covered by gene
+		"""
+		row = unpack_rows(self.bits[self.gene_idx[gene]], self.nsamples)[0]
+		return list(np.flatnonzero(row))
+
+	def to_bool(self):
+		""" ngenes x nsamples boolean matrix
+		"""
+		return unpack_rows(self.bits, self.nsamples)
+
+	def weight_row(self, gene):
+		""" edge weights of gene (1 for altered samples if no weights are kept)
+		"""
+		i = self.gene_idx[gene]
+		if self.weights is not None:
+			return self.weights[i]
+		return unpack_rows(self.bits[i], self.nsamples)[0].astype(np.float32)
+
+	def weight_dic(self):
+		""" gene -> edge weights (rows of weights, no copy)
+		"""
+		return dict([(g, self.weight_row(g)) for g in self.genes])
+
+	def list_dic(self):
+		""" gene -> list of covered sample indices (genes covering no sample are omitted)
+		compatible with read_mut_list/write_mut_list
+		"""
+		rows = self.to_bool()
+		list_dic = {}
+		for i, g in enumerate(self.genes):
+			idxs = np.flatnonzero(rows[i])
+			if len(idxs) > 0:
+				list_dic[g] = [int(x) for x in idxs]
+		return list_dic
+
+	def pair_cover(self, g1, g2):
+		""" size of the cover |A(g1) U A(g2)| = popcount(bits[g1] | bits[g2])
+		0 if either gene does not exist
+		"""
+		if g1 not in self or g2 not in self:
+			return 0
+		return int(popcount(self.bits[self.gene_idx[g1]] | self.bits[self.gene_idx[g2]]))
+
+	def masked(self, sample_idxs):
+		""" copy restricted to the given samples (other bits cleared)
+		genes, samples and their indices are unchanged
+
+		:param sample_idxs: sample indices to keep
+		:return: MutMatrix
+		"""
+		mask = sample_mask(sample_idxs, self.nsamples)
+		return MutMatrix(self.genes, self.samples, self.bits & mask, present=self.present)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# binary archive of permutation instances (packed bitsets, many instances per file)
+
+"""
+archive layout (little endian)
+	fixed header: magic (8 bytes), version (uint32), compressed (uint32),
+		index offset (uint64), meta length (uint64)
+	meta: json {"genes": [...], "nsamples": int, "nwords": int}, padded to 64 bytes
+	instances: ngenes x nwords uint64 bitsets for each instance (zlib compressed if compressed),
+		each padded to 8 bytes
+	index: json {"fids": [...], "offsets": [...], "lengths": [...]} at index offset
+
+instances are aligned to the genes in the meta; genes covering no sample are regarded
+as not present as in the text permutation files (see io.write_mut_list)
+uncompressed instances are read from a memory map without copying
+"""
+
+import json
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+import utils.io as io
+from utils.mut_matrix import MutMatrix, popcount
+
+MAGIC = b"MEMCPERM"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQQ")
+
+
+def _pad(f, size):
+	""" write zeros until the file position is a multiple of size """
+	pos = f.tell()
+	if pos % size != 0:
+		f.write(b"\0" * (size - pos % size))
+
+
+class PermArchiveWriter(object):
+	""" write permutation instances into an archive one by one
+
+	example:
+		writer = PermArchiveWriter(filename, genes, nsamples)
+		writer.append(fid, mut_matrix)
+		writer.close()
+	"""
+
+	def __init__(self, filename, genes, nsamples, compress=False):
+		"""
+		:param filename
+		:param genes: list of genes (row order of every instance)
+		:param nsamples: number of samples
+		:param compress: compress each instance with zlib
+		"""
+		self.genes = list(genes)
+		self.nsamples = nsamples
+		self.nwords = (nsamples + 63) // 64
+		self.compress = compress
+		self.fids, self.offsets, self.lengths = [], [], []
+		self.f = open(filename, "wb")
+		meta = json.dumps({"genes": self.genes, "nsamples": nsamples, "nwords": self.nwords}).encode("utf-8")
+		self.f.write(_HEADER.pack(MAGIC, VERSION, int(compress), 0, len(meta)))
+		self.f.write(meta)
+		_pad(self.f, 64)
+
+	def append(self, fid, instance):
+		"""
+		:param fid: permutation file id
+		:param instance: MutMatrix with the genes of the archive (or ngenes x nwords bitsets)
+		"""
+		bits = instance.bits if isinstance(instance, MutMatrix) else instance
+		bits = np.ascontiguousarray(bits, dtype="<u8")
+		if bits.shape != (len(self.genes), self.nwords):
+			raise ValueError("instance %d does not match the genes/samples of the archive" % fid)
+		data = bits.tobytes()
+		if self.compress:
+			data = zlib.compress(data)
+		self.fids.append(int(fid))
+		self.offsets.append(self.f.tell())
+		self.lengths.append(len(data))
+		self.f.write(data)
+		_pad(self.f, 8)
+
+	def close(self):
+		index_offset = self.f.tell()
+		self.f.write(json.dumps({"fids": self.fids, "offsets": self.offsets, "lengths": self.lengths}).encode("utf-8"))
+		# fill in the index offset of the fixed header
+		self.f.seek(16)
+		self.f.write(struct.pack("<Q", index_offset))
+		self.f.close()
+
+
+class PermArchive(object):
+	""" read permutation instances from an archive (memory mapped)
+
+	genes: list of genes, nsamples: number of samples
+	fids: permutation file ids in the archive (in the stored order)
+	"""
+
+	def __init__(self, filename):
+		self.f = open(filename, "rb")
+		self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+		(magic, version, compressed, index_offset, meta_len) = _HEADER.unpack_from(self.mm, 0)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError("%s is not a permutation archive" % filename)
+		if index_offset == 0:
+			raise ValueError("%s is incomplete (writer not closed)" % filename)
+		meta = json.loads(self.mm[_HEADER.size:_HEADER.size+meta_len].decode("utf-8"))
+		index = json.loads(self.mm[index_offset:].decode("utf-8"))
+		self.compressed = bool(compressed)
+		self.genes = meta["genes"]
+		self.nsamples = meta["nsamples"]
+		self.nwords = meta["nwords"]
+		self.fids = index["fids"]
+		self.offsets = index["offsets"]
+		self.lengths = index["lengths"]
+
+	def __len__(self):
+		return len(self.fids)
+
+	def bits(self, k):
+		""" bitsets of the k-th instance (ngenes x nwords), a view of the memory map if not compressed
+		"""
+		(offset, length) = (self.offsets[k], self.lengths[k])
+		if self.compressed:
+			data = zlib.decompress(self.mm[offset:offset+length])
+			return np.frombuffer(data, dtype="<u8").reshape(len(self.genes), self.nwords)
+		return np.frombuffer(self.mm, dtype="<u8", count=len(self.genes)*self.nwords, offset=offset).reshape(
+			len(self.genes), self.nwords)
+
+	def get(self, k, template=None):
+		""" k-th instance as a MutMatrix
+
+		:param k: instance index (not fid)
+		:param template: (optional) MutMatrix of the original profile;
+				the instance is aligned to its genes and shares its gene/sample indices
+		:return: MutMatrix
+		"""
+		bits = self.bits(k)
+		if template is None:
+			return MutMatrix(self.genes, range(self.nsamples), bits, present=popcount(bits) > 0)
+		if template.genes != self.genes:
+			rows = np.array([template.gene_idx.get(g, -1) for g in self.genes])
+			aligned = np.zeros((template.ngenes, self.nwords), dtype=np.uint64)
+			aligned[rows[rows >= 0]] = bits[rows >= 0]
+			bits = aligned
+		return MutMatrix.like(template, bits, popcount(bits) > 0)
+
+	def close(self):
+		self.mm.close()
+		self.f.close()
+
+
+def convert_mut_lists(pfile_prefix, fids, archive_file, genes, samples, compress=False, sep=","):
+	""" convert permutation files in the list format (see io.read_mut_list) into an archive
+	missing files are skipped
+
+	:param pfile_prefix: permutation file prefix (pfile_prefix+fid+".txt")
+	:param fids: permutation file ids
+	:param archive_file: archive filename
+	:param genes: list of genes (e.g., genes of the original profile)
+	:param samples: list of samples
+	:param compress: compress each instance
+	:return: fids written
+	"""
+	writer = PermArchiveWriter(archive_file, genes, len(samples), compress)
+	for fid in fids:
+		try:
+			instance = io.read_mut_list_bits(pfile_prefix+str(fid)+".txt", samples, genes, sep)
+		except IOError:
+			continue
+		writer.append(fid, instance)
+	writer.close()
+	return writer.fids
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# edge scores between genes as a sparse adjacency (compressed sparse rows)
+
+import numpy as np
+
+
+class ScoreGraph(object):
+	""" edge scores score(x, y) stored in compressed sparse row format
+	(replaces dict of dicts score_dic[x][y] with integer gene ids and float32 weights)
+
+	genes: list of genes, gene_idx: gene -> id
+	indptr: int64 array, entries of row i are indptr[i]:indptr[i+1]
+	indices: int32 array, column ids (sorted within each row)
+	weights: float32 array, scores of the entries (or dtype given)
+	score(x, y) = weight of y in the row of x, 0 if there is no entry (as score_dic[x][y])
+	"""
+
+	def __init__(self, genes, indptr, indices, weights, dtype=np.float32):
+		self.genes = list(genes)
+		self.gene_idx = dict([(g, i) for i, g in enumerate(self.genes)])
+		self.indptr = np.asarray(indptr, dtype=np.int64)
+		self.indices = np.asarray(indices, dtype=np.int32)
+		self.weights = np.asarray(weights, dtype=dtype)
+		self._keys = None  # sorted keys of the entries (see lookup)
+
+	@classmethod
+	def from_edges(cls, xs, ys, scores, genes=None, symmetric=False, dtype=np.float32):
+		""" construct from a list of scored gene pairs
+
+		:param xs: first genes
+		:param ys: second genes
+		:param scores: score of each pair
+		:param genes: (optional) list of genes (ids); genes in pairs are appended if missing
+		:param symmetric: add score(y, x) = score(x, y) unless (y, x) is given
+				(same as misc.get_val on the dict with the given pairs)
+		:param dtype: type of the weights (float32 by default)
+		:return: ScoreGraph
+		"""
+		genes = [] if genes is None else list(genes)
+		gene_idx = dict([(g, i) for i, g in enumerate(genes)])
+		for g in list(xs) + list(ys):
+			if g not in gene_idx:
+				gene_idx[g] = len(genes)
+				genes.append(g)
+		rows = np.array([gene_idx[x] for x in xs], dtype=np.int64)
+		cols = np.array([gene_idx[y] for y in ys], dtype=np.int64)
+		weights = np.asarray(scores, dtype=dtype)
+		# priority: later pairs overwrite earlier ones, given pairs overwrite reversed ones
+		priority = np.arange(len(rows))
+		if symmetric:
+			(rows, cols) = (np.concatenate([cols, rows]), np.concatenate([rows, cols]))
+			weights = np.concatenate([weights, weights])
+			priority = np.concatenate([priority - len(priority), priority])
+		order = np.lexsort((priority, cols, rows))
+		(rows, cols, weights) = (rows[order], cols[order], weights[order])
+		last = np.ones(len(rows), dtype=bool)
+		last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+		(rows, cols, weights) = (rows[last], cols[last], weights[last])
+		indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(genes)))])
+		return cls(genes, indptr, cols, weights, dtype)
+
+	@classmethod
+	def from_dic(cls, score_dic, symmetric=False):
+		""" construct from a dict of dicts score_dic[x][y]
+
+		:param score_dic: edge score dic
+		:param symmetric: see from_edges
+		:return: ScoreGraph
+		"""
+		(xs, ys, scores) = ([], [], [])
+		for x in score_dic:
+			for y in score_dic[x]:
+				xs.append(x)
+				ys.append(y)
+				scores.append(score_dic[x][y])
+		return cls.from_edges(xs, ys, scores, list(score_dic), symmetric)
+
+	@classmethod
+	def from_nx(cls, G, attr="weight"):
+		""" construct from an undirected graph with edge scores (both directions)
+
+		:param G: nx.Graph
+		:param attr: edge attribute of the scores
+		:return: ScoreGraph
+		"""
+		edges = list(G.edges(data=attr, default=0))
+		(xs, ys, scores) = ([e[0] for e in edges], [e[1] for e in edges], [e[2] for e in edges])
+		return cls.from_edges(xs, ys, scores, list(G), symmetric=True)
+
+	def __len__(self):
+		return len(self.genes)
+
+	def __contains__(self, gene):
+		return gene in self.gene_idx
+
+	def row(self, x):
+		""" column ids and scores of the entries of x (empty if x does not exist)
+		"""
+		if x not in self.gene_idx:
+			return self.indices[:0], self.weights[:0]
+		i = self.gene_idx[x]
+		(start, end) = (self.indptr[i], self.indptr[i+1])
+		return self.indices[start:end], self.weights[start:end]
+
+	def score(self, x, y):
+		""" score(x, y), 0 if there is no entry
+		"""
+		if y not in self.gene_idx:
+			return 0
+		(cols, weights) = self.row(x)
+		j = np.searchsorted(cols, self.gene_idx[y])
+		if j < len(cols) and cols[j] == self.gene_idx[y]:
+			return float(weights[j])
+		return 0
+
+	def ids(self, genes):
+		""" ids of the given genes (-1 for genes not in the graph)
+		"""
+		return np.array([self.gene_idx.get(g, -1) for g in genes], dtype=np.int64)
+
+	def member_mask(self, genes):
+		""" boolean array over the ids, True for the given genes
+		"""
+		mask = np.zeros(len(self.genes), dtype=bool)
+		ids = self.ids(genes)
+		mask[ids[ids >= 0]] = True
+		return mask
+
+	def lookup(self, xs, ys):
+		""" score(x, y) for each pair (x, y) in zip(xs, ys), 0 if there is no entry
+
+		:param xs: genes
+		:param ys: genes
+		:return: float64 array
+		"""
+		if self._keys is None:
+			# entries are sorted by (row, column), so row * n + column is sorted
+			rows = np.repeat(np.arange(len(self.genes), dtype=np.int64), np.diff(self.indptr))
+			self._keys = rows * len(self.genes) + self.indices
+		(x_ids, y_ids) = (self.ids(xs), self.ids(ys))
+		if len(self._keys) == 0:
+			return np.zeros(len(x_ids))
+		keys = x_ids * len(self.genes) + y_ids
+		pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys)-1)
+		found = (x_ids >= 0) & (y_ids >= 0) & (self._keys[pos] == keys)
+		return np.where(found, self.weights[pos].astype(np.float64), 0)
+
+	def row_sums(self, xs, mask):
+		""" sum of score(x, y) over y in mask for each x (only the entries of xs are visited)
+
+		:param xs: genes
+		:param mask: boolean array over the ids (see member_mask)
+		:return: float64 array
+		"""
+		ids = self.ids(xs)
+		valid = ids >= 0
+		ids = np.where(valid, ids, 0)
+		(starts, ends) = (self.indptr[ids], self.indptr[ids+1])
+		lengths = np.where(valid, ends - starts, 0)
+		# positions of the entries of all rows
+		offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+		pos = np.arange(lengths.sum()) + offsets
+		values = np.where(mask[self.indices[pos]], self.weights[pos].astype(np.float64), 0)
+		sums = np.zeros(len(xs))
+		np.add.at(sums, np.repeat(np.arange(len(xs)), lengths), values)
+		return sums